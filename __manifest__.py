@@ -1,6 +1,6 @@
 {
     'name': 'Manifiesto Ambiental',
-    'version': '19.0.2.2.0',
+    'version': '19.0.2.5.0',
     'category': 'Environmental',
     'summary': 'Gestión de Manifiestos Ambientales para Residuos Peligrosos con Control de Versiones',
     'description': '...',
@@ -20,16 +20,24 @@
         'security/ir.model.access.csv',
         'data/sequences.xml',
         'data/transito_directo_cron.xml',
+        'data/numbering_params.xml',
+        'data/folio_lease_cron.xml',
+        'data/lot_gc_cron.xml',
+        'data/chatter_queue_cron.xml',
 
         'views/manifiesto_ambiental_assets.xml',
         'views/res_partner_views.xml',
         'views/manifiesto_ambiental_views.xml',
+        'views/manifiesto_bulk_actions.xml',
 
         # IMPORTANTE:
         # Primero se crea la acción de discrepancias.
         # Luego el menú puede apuntar a esa acción.
         'views/views_discrepancia.xml',
         'views/discrepancy_log_views.xml',
+        'views/manifiesto_folio_counter_views.xml',
+        'views/manifiesto_lock_wait_views.xml',
+        'views/manifiesto_folio_lease_views.xml',
         'views/manifiesto_ambiental_menus.xml',
 
         'views/service_order_manifiesto_button.xml',
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark de concurrencia de la numeración de folios del Manifiesto Ambiental.
+
+Abre N cursores en paralelo contra una base local con el módulo instalado y,
+en cada uno, crea y confirma manifiestos. Se ejecutan dos escenarios:
+
+- mismo: todos los workers usan el mismo generador (máxima contención);
+- distinto: cada worker usa su propio generador.
+
+Reporta throughput, tiempos de espera del bloqueo de numeración (p50/p99),
+reintentos por conflictos de serialización y folios duplicados o saltados.
+
+Uso:
+    python benchmarks/bench_folio_concurrency.py -c /etc/odoo/odoo.conf -d midb \
+        --workers 8 --per-worker 25
+
+Los generadores y manifiestos creados se eliminan al final salvo --keep.
+"""
+import argparse
+import statistics
+import threading
+import time
+
+import odoo
+from odoo import api, SUPERUSER_ID
+from odoo.exceptions import UserError
+from odoo.modules.registry import Registry
+
+try:
+    from psycopg2.errors import LockNotAvailable, SerializationFailure, DeadlockDetected
+except ImportError:  # psycopg2 < 2.8
+    from psycopg2.extensions import TransactionRollbackError as SerializationFailure
+    LockNotAvailable = DeadlockDetected = SerializationFailure
+
+RETRYABLE_ERRORS = (SerializationFailure, DeadlockDetected, LockNotAvailable)
+MAX_RETRIES = 10
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+class LockTimer:
+    """Mide el tiempo que cada llamada a _lock_daily_numbering pasa esperando."""
+
+    def __init__(self, model_class):
+        self.model_class = model_class
+        self.original = model_class._lock_daily_numbering
+        self.samples = []
+        self.guard = threading.Lock()
+
+    def __enter__(self):
+        timer = self
+        original = self.original
+
+        def timed_lock(model, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(model, *args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                with timer.guard:
+                    timer.samples.append(elapsed)
+
+        self.model_class._lock_daily_numbering = timed_lock
+        return self
+
+    def __exit__(self, *exc):
+        self.model_class._lock_daily_numbering = self.original
+
+
+def manifiesto_vals(generador, fecha):
+    return {
+        'generador_id': generador.id,
+        'generador_fecha': fecha,
+        'numero_registro_ambiental': 'BENCH',
+        'generador_nombre': generador.name,
+        'transportista_nombre': 'BENCH TRANSPORTISTA',
+        'destinatario_nombre': 'BENCH DESTINATARIO',
+    }
+
+
+def worker(registry, generador_id, fecha, count, stats, barrier):
+    barrier.wait()
+    for _i in range(count):
+        for attempt in range(MAX_RETRIES):
+            try:
+                with registry.cursor() as cr:
+                    env = api.Environment(cr, SUPERUSER_ID, {})
+                    generador = env['res.partner'].browse(generador_id)
+                    manifiesto = env['manifiesto.ambiental'].create(manifiesto_vals(generador, fecha))
+                    manifiesto.action_confirm()
+                with stats['guard']:
+                    stats['created'] += 1
+                break
+            except RETRYABLE_ERRORS:
+                with stats['guard']:
+                    stats['retries'] += 1
+                time.sleep(0.01 * (attempt + 1))
+            except UserError:
+                # Se agotó la espera del bloqueo de numeración (lock_timeout
+                # y reintentos del contador): cuenta como fallido.
+                with stats['guard']:
+                    stats['failed'] += 1
+                break
+        else:
+            with stats['guard']:
+                stats['failed'] += 1
+
+
+def check_folios(env, generador_ids, fecha):
+    """Cuenta consecutivos duplicados y saltados entre los folios oficiales."""
+    env.cr.execute(
+        """
+        SELECT generador_id, folio_seq, COUNT(*)
+          FROM manifiesto_ambiental
+         WHERE generador_id IN %s
+           AND generador_fecha = %s
+           AND state IN ('confirmed', 'in_transit', 'delivered')
+           AND folio_base IS NOT NULL
+         GROUP BY generador_id, folio_seq
+        """,
+        [tuple(generador_ids), fecha],
+    )
+    seqs_by_generador = {}
+    duplicates = 0
+    for generador_id, folio_seq, total in env.cr.fetchall():
+        seqs_by_generador.setdefault(generador_id, set()).add(folio_seq)
+        duplicates += total - 1
+
+    gaps = sum(
+        max(seqs) - len(seqs)
+        for seqs in seqs_by_generador.values()
+        if seqs
+    )
+    return duplicates, gaps
+
+
+def run_scenario(registry, name, workers, per_worker, fecha, same_generador, created_partner_ids):
+    with registry.cursor() as cr:
+        env = api.Environment(cr, SUPERUSER_ID, {})
+        total_generadores = 1 if same_generador else workers
+        generadores = env['res.partner'].create([
+            {
+                'name': 'BENCH %s GENERADOR %03d' % (name.upper(), index),
+                'manifiesto_iniciales': 'B%s' % chr(ord('A') + index % 26),
+                'es_generador': True,
+            }
+            for index in range(total_generadores)
+        ])
+        generador_ids = generadores.ids
+        created_partner_ids.extend(generador_ids)
+
+    stats = {'created': 0, 'retries': 0, 'failed': 0, 'guard': threading.Lock()}
+    barrier = threading.Barrier(workers)
+    ManifiestoClass = registry['manifiesto.ambiental']
+
+    with LockTimer(ManifiestoClass) as lock_timer:
+        threads = [
+            threading.Thread(
+                target=worker,
+                args=(
+                    registry,
+                    generador_ids[0 if same_generador else index],
+                    fecha,
+                    per_worker,
+                    stats,
+                    barrier,
+                ),
+            )
+            for index in range(workers)
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+    with registry.cursor() as cr:
+        env = api.Environment(cr, SUPERUSER_ID, {})
+        duplicates, gaps = check_folios(env, generador_ids, fecha)
+        counters = env['manifiesto.ambiental.folio.counter'].search([('generador_id', 'in', generador_ids)])
+        contended = sum(counters.mapped('lock_contention_count'))
+
+    waits_ms = [sample * 1000.0 for sample in lock_timer.samples]
+    print("Escenario: %s generador" % name)
+    print("  workers=%s manifiestos=%s fallidos=%s reintentos=%s" % (
+        workers, stats['created'], stats['failed'], stats['retries']))
+    print("  throughput: %.1f manifiestos/s (%.2f s)" % (stats['created'] / elapsed if elapsed else 0.0, elapsed))
+    print("  espera de bloqueo: p50=%.2f ms p99=%.2f ms media=%.2f ms (%s muestras)" % (
+        percentile(waits_ms, 50),
+        percentile(waits_ms, 99),
+        statistics.mean(waits_ms) if waits_ms else 0.0,
+        len(waits_ms),
+    ))
+    print("  esperas con contención registradas en contadores: %s" % contended)
+    print("  folios duplicados=%s saltados=%s" % (duplicates, gaps))
+    return duplicates
+
+
+def cleanup(registry, partner_ids):
+    with registry.cursor() as cr:
+        env = api.Environment(cr, SUPERUSER_ID, {})
+        manifiestos = env['manifiesto.ambiental'].search([('generador_id', 'in', partner_ids)])
+        manifiestos.unlink()
+        env['manifiesto.ambiental.folio.counter'].search([('generador_id', 'in', partner_ids)]).unlink()
+        env['res.partner'].browse(partner_ids).unlink()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-c', '--config', help='Archivo de configuración de Odoo')
+    parser.add_argument('-d', '--database', required=True)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--per-worker', type=int, default=25)
+    parser.add_argument('--fecha', default=None, help='Fecha de los manifiestos (YYYY-MM-DD), por defecto hoy')
+    parser.add_argument('--keep', action='store_true', help='No borrar los datos generados')
+    args = parser.parse_args()
+
+    config_args = ['-d', args.database, '--db_maxconn', str(max(64, args.workers * 2 + 4))]
+    if args.config:
+        config_args = ['-c', args.config] + config_args
+    odoo.tools.config.parse_config(config_args)
+
+    registry = Registry(args.database)
+    fecha = odoo.fields.Date.to_date(args.fecha) if args.fecha else odoo.fields.Date.today()
+
+    created_partner_ids = []
+    duplicates = 0
+    try:
+        duplicates += run_scenario(registry, 'mismo', args.workers, args.per_worker, fecha, True, created_partner_ids)
+        duplicates += run_scenario(registry, 'distinto', args.workers, args.per_worker, fecha, False, created_partner_ids)
+    finally:
+        if not args.keep and created_partner_ids:
+            cleanup(registry, created_partner_ids)
+
+    return 1 if duplicates else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
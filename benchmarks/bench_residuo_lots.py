@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark de consultas SQL para la asignación de lotes de residuos.
+
+Crea manifiestos con 1, 50 y 500 líneas de residuo (10 líneas por manifiesto,
+5 productos) y mide cuántas consultas hace `_create_lot_for_residuo` en dos
+casos:
+
+- nuevos: ningún lote existe todavía y deben crearse;
+- existentes: todos los lotes ya existen y solo se asignan.
+
+Para comparar, también mide la versión anterior (búsqueda y create por
+línea), reimplementada aquí.
+
+Uso:
+    python benchmarks/bench_residuo_lots.py -c /etc/odoo/odoo.conf -d midb
+
+Todo se ejecuta en una transacción que se revierte al final.
+"""
+import argparse
+import time
+
+import odoo
+from odoo import api, SUPERUSER_ID
+from odoo.modules.registry import Registry
+
+LINE_COUNTS = (1, 50, 500)
+LINES_PER_MANIFIESTO = 10
+PRODUCT_COUNT = 5
+
+
+def legacy_create_lot_for_residuo(residuos):
+    """Implementación anterior: una búsqueda y un create/write por línea."""
+    env = residuos.env
+    for record in residuos:
+        if record.product_id and record.manifiesto_id.numero_manifiesto:
+            existing_lot = env['stock.lot'].search([
+                ('name', '=', record.manifiesto_id.numero_manifiesto),
+                ('product_id', '=', record.product_id.id),
+                ('company_id', '=', record.manifiesto_id.company_id.id),
+            ], limit=1)
+            if not existing_lot:
+                lot = env['stock.lot'].create({
+                    'name': record.manifiesto_id.numero_manifiesto,
+                    'product_id': record.product_id.id,
+                    'company_id': record.manifiesto_id.company_id.id,
+                })
+                record.lot_id = lot.id
+            else:
+                record.lot_id = existing_lot.id
+
+
+def current_create_lot_for_residuo(residuos):
+    residuos._create_lot_for_residuo()
+
+
+def prepare_data(env, line_count, tag):
+    generador = env['res.partner'].create({
+        'name': 'BENCH LOTES %s' % tag,
+        'manifiesto_iniciales': 'BL',
+        'es_generador': True,
+    })
+    products = env['product.product'].create([
+        {'name': 'BENCH RESIDUO %s-%s' % (tag, index), 'is_storable': True, 'tracking': 'lot'}
+        for index in range(PRODUCT_COUNT)
+    ])
+
+    manifiesto_count = max(1, -(-line_count // LINES_PER_MANIFIESTO))
+    manifiestos = env['manifiesto.ambiental'].create([
+        {
+            'generador_id': generador.id,
+            'numero_manifiesto': 'BENCH-%s-%04d' % (tag, index),
+            'numero_registro_ambiental': 'BENCH',
+            'generador_nombre': generador.name,
+            'transportista_nombre': 'BENCH TRANSPORTISTA',
+            'destinatario_nombre': 'BENCH DESTINATARIO',
+        }
+        for index in range(manifiesto_count)
+    ])
+
+    residuos = env['manifiesto.ambiental.residuo'].create([
+        {
+            'manifiesto_id': manifiestos[index // LINES_PER_MANIFIESTO].id,
+            'product_id': products[index % PRODUCT_COUNT].id,
+            'nombre_residuo': 'BENCH %s' % index,
+            'cantidad': 1.0,
+        }
+        for index in range(line_count)
+    ])
+    return residuos
+
+
+def reset_lots(env, residuos, delete_lots):
+    lots = residuos.lot_id
+    env.cr.execute("UPDATE manifiesto_ambiental_residuo SET lot_id = NULL WHERE id IN %s", [tuple(residuos.ids)])
+    if delete_lots and lots:
+        env.cr.execute("DELETE FROM stock_lot WHERE id IN %s", [tuple(lots.ids)])
+    env.invalidate_all()
+
+
+def measure(env, residuos, implementation):
+    env.flush_all()
+    env.invalidate_all()
+    residuos = residuos.browse(residuos.ids)
+
+    queries_before = env.cr.sql_log_count
+    start = time.perf_counter()
+    implementation(residuos)
+    env.flush_all()
+    elapsed = time.perf_counter() - start
+    return env.cr.sql_log_count - queries_before, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-c', '--config', help='Archivo de configuración de Odoo')
+    parser.add_argument('-d', '--database', required=True)
+    args = parser.parse_args()
+
+    config_args = ['-d', args.database]
+    if args.config:
+        config_args = ['-c', args.config] + config_args
+    odoo.tools.config.parse_config(config_args)
+
+    registry = Registry(args.database)
+    implementations = (
+        ('anterior', legacy_create_lot_for_residuo),
+        ('actual', current_create_lot_for_residuo),
+    )
+
+    print("%-8s %-10s %-10s %10s %10s" % ('líneas', 'versión', 'lotes', 'consultas', 'ms'))
+    with registry.cursor() as cr:
+        env = api.Environment(cr, SUPERUSER_ID, {})
+        try:
+            for line_count in LINE_COUNTS:
+                residuos = prepare_data(env, line_count, line_count)
+                for name, implementation in implementations:
+                    for case, delete_lots in (('nuevos', True), ('existentes', False)):
+                        reset_lots(env, residuos, delete_lots)
+                        queries, elapsed = measure(env, residuos, implementation)
+                        print("%-8s %-10s %-10s %10s %10.1f" % (line_count, name, case, queries, elapsed * 1000.0))
+        finally:
+            cr.rollback()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+from odoo import api, SUPERUSER_ID
+
+
+def migrate(cr, version):
+    """Inicializa los contadores de folio diarios desde los folios existentes."""
+    if not version:
+        return
+
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    env['manifiesto.ambiental.folio.counter']._backfill_from_manifiestos()
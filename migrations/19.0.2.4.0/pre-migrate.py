@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+
+def migrate(cr, version):
+    """
+    Crea y llena folio_base / folio_seq en SQL antes de cargar el modelo,
+    para que el ORM no recalcule los campos registro por registro.
+    """
+    if not version:
+        return
+
+    cr.execute("""
+        ALTER TABLE manifiesto_ambiental
+            ADD COLUMN IF NOT EXISTS folio_base varchar,
+            ADD COLUMN IF NOT EXISTS folio_seq int4
+    """)
+    cr.execute(r"""
+        UPDATE manifiesto_ambiental m
+           SET folio_base = parts.match[1],
+               folio_seq = COALESCE(parts.match[2]::int4, 1)
+          FROM (
+                SELECT id,
+                       regexp_match(
+                           upper(btrim(numero_manifiesto)),
+                           '^(\w{1,4}-\d{8})(?:-(\d{1,6}))?$'
+                       ) AS match
+                  FROM manifiesto_ambiental
+               ) parts
+         WHERE parts.id = m.id
+           AND parts.match IS NOT NULL
+           AND COALESCE(parts.match[2]::int4, 1) > 0
+    """)
+    cr.execute("""
+        UPDATE manifiesto_ambiental
+           SET folio_seq = 0
+         WHERE folio_seq IS NULL
+    """)
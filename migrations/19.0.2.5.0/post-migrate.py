@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+import logging
+
+from odoo import api, SUPERUSER_ID
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """
+    Reporta cuántos lotes de folio existentes no habrían hecho falta con la
+    creación diferida de lotes (parámetro manifiesto_ambiental.lot_creation_mode).
+    No modifica datos.
+    """
+    if not version:
+        return
+
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    report = env['manifiesto.ambiental']._get_deferred_lot_report()
+    en_confirmacion = report['huerfanos'] + report['borrador'] + report['cancelados']
+
+    _logger.info(
+        "Lotes de folio sin movimientos: %s huérfanos (renumeraciones), %s de borradores, "
+        "%s de cancelados, %s de manifiestos sin recepción.",
+        report['huerfanos'], report['borrador'], report['cancelados'], report['sin_recepcion'],
+    )
+    _logger.info(
+        "Lotes que no habrían sido necesarios: %s en modo 'confirm', %s en modo 'receive'.",
+        en_confirmacion, en_confirmacion + report['sin_recepcion'],
+    )
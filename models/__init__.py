@@ -1,7 +1,12 @@
 from . import manifiesto_ambiental
+from . import manifiesto_folio_counter
+from . import manifiesto_folio_lease
+from . import manifiesto_lock_wait
+from . import manifiesto_chatter_queue
 from . import service_order_extension
 from . import res_partner_extension
 from . import product_extension
+from . import fleet_vehicle_extension
 from . import recepcion_extension 
 from . import manifiesto_discrepancia
 from . import transito_directo_extension
\ No newline at end of file
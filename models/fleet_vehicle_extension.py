@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api
+
+
+class FleetVehicle(models.Model):
+    _inherit = 'fleet.vehicle'
+
+    tipo_vehiculo_manifiesto = fields.Char(
+        string='Tipo de Vehículo (Manifiesto)',
+        compute='_compute_tipo_vehiculo_manifiesto',
+        store=True,
+        help='Texto que se copia al campo 11. Tipo de vehículo del manifiesto.',
+    )
+
+    @api.depends('tag_ids', 'tag_ids.name', 'model_id', 'model_id.name', 'model_id.brand_id.name', 'name')
+    def _compute_tipo_vehiculo_manifiesto(self):
+        """
+        Regla de negocio:
+        El tipo de vehículo se toma de las etiquetas del vehículo, concatenadas
+        con un espacio y sin repetir (ej. [CAJA SECA, TORTON] -> CAJA SECA TORTON).
+        Si el vehículo no tiene etiquetas, se usa marca y modelo, y si tampoco
+        hay modelo, el nombre del vehículo.
+        """
+        for vehicle in self:
+            tag_names = []
+            seen = set()
+            for tag in vehicle.tag_ids:
+                name = (tag.name or '').strip()
+                key = name.lower()
+                if name and key not in seen:
+                    tag_names.append(name)
+                    seen.add(key)
+
+            if tag_names:
+                vehicle.tipo_vehiculo_manifiesto = ' '.join(tag_names)
+            else:
+                brand = vehicle.model_id.brand_id.name or ''
+                model = vehicle.model_id.name or ''
+                vehicle.tipo_vehiculo_manifiesto = f"{brand} {model}".strip() or vehicle.name or ''
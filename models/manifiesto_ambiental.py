@@ -2,6 +2,7 @@
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError
 from urllib.parse import quote
+from collections import defaultdict
 import base64
 import logging
 import re
@@ -13,6 +14,57 @@ MANIFIESTO_CHILD_ONLY_DISPLAY_CONTEXT = {
     'manifiesto_child_only_display': True,
 }
 
+# Folio automático: INICIALES-DDMMYYYY[-NN]. El consecutivo se limita a 6
+# dígitos para que siempre quepa en folio_seq (int4).
+MANIFIESTO_AUTO_FOLIO_RE = re.compile(r'^([\w]{1,4}-(\d{2})(\d{2})(\d{4}))(?:-(\d{1,6}))?$')
+
+# Datos que cada rol copia del contacto al manifiesto:
+# {campo many2one del rol: {campo del manifiesto: dato del contacto}}.
+# 'nombre_documental' es nombre_en_manifiesto o, si está vacío, el nombre;
+# 'state_id' se copia como el nombre del estado.
+MANIFIESTO_PARTNER_FIELD_MAP = {
+    'generador_id': {
+        'numero_registro_ambiental': 'numero_registro_ambiental',
+        'generador_nombre': 'nombre_documental',
+        'generador_codigo_postal': 'zip',
+        'generador_calle': 'street',
+        'generador_num_ext': 'street_number',
+        'generador_num_int': 'street_number2',
+        'generador_colonia': 'street2',
+        'generador_municipio': 'city',
+        'generador_estado': 'state_id',
+        'generador_telefono': 'phone',
+        'generador_email': 'email',
+    },
+    'transportista_id': {
+        'transportista_nombre': 'nombre_documental',
+        'transportista_codigo_postal': 'zip',
+        'transportista_calle': 'street',
+        'transportista_num_ext': 'street_number',
+        'transportista_num_int': 'street_number2',
+        'transportista_colonia': 'street2',
+        'transportista_municipio': 'city',
+        'transportista_estado': 'state_id',
+        'transportista_telefono': 'phone',
+        'transportista_email': 'email',
+        'numero_autorizacion_semarnat': 'numero_autorizacion_semarnat',
+        'numero_permiso_sct': 'numero_permiso_sct',
+    },
+    'destinatario_id': {
+        'destinatario_nombre': 'nombre_documental',
+        'destinatario_codigo_postal': 'zip',
+        'destinatario_calle': 'street',
+        'destinatario_num_ext': 'street_number',
+        'destinatario_num_int': 'street_number2',
+        'destinatario_colonia': 'street2',
+        'destinatario_municipio': 'city',
+        'destinatario_estado': 'state_id',
+        'destinatario_telefono': 'phone',
+        'destinatario_email': 'email',
+        'numero_autorizacion_semarnat_destinatario': 'numero_autorizacion_semarnat',
+    },
+}
+
 
 class ManifiestoAmbiental(models.Model):
     _name = 'manifiesto.ambiental'
@@ -84,11 +136,33 @@ class ManifiestoAmbiental(models.Model):
             'remanifestaciones.'
         ),
     )
+    folio_lease_id = fields.Many2one(
+        'manifiesto.ambiental.folio.lease',
+        string='Préstamo de Folios',
+        copy=False,
+        readonly=True,
+        index='btree_not_null',
+        help='Bloque de folios prestado del que proviene el folio (captura sin conexión).',
+    )
     numero_manifiesto_display = fields.Char(
         string='Número de Manifiesto',
         compute='_compute_numero_manifiesto_display',
         store=True,
     )
+    folio_base = fields.Char(
+        string='Base del Folio',
+        compute='_compute_folio_parts',
+        store=True,
+        copy=False,
+        help='Parte INICIALES-DDMMYYYY de un folio automático.',
+    )
+    folio_seq = fields.Integer(
+        string='Consecutivo del Folio',
+        compute='_compute_folio_parts',
+        store=True,
+        copy=False,
+        help='Consecutivo diario del folio automático (BASE = 1, BASE-02 = 2...).',
+    )
     pagina = fields.Integer(string='3. Página', default=1)
 
     # =========================================================================
@@ -288,6 +362,8 @@ class ManifiestoAmbiental(models.Model):
     ], string='Estado', default='draft', required=True, tracking=True)
     company_id = fields.Many2one('res.company', string='Compañía', default=lambda self: self.env.company)
 
+    _company_generador_folio_idx = models.Index('(company_id, generador_id, folio_base, folio_seq)')
+
     # =========================================================================
     # HELPERS
     # =========================================================================
@@ -313,81 +389,69 @@ class ManifiestoAmbiental(models.Model):
 
         return nombre_mascara or (partner.name or '')
 
-    def _get_vehicle_tags_text(self, vehicle):
-        """
-        Devuelve el texto plano para el campo 11. Tipo de vehículo.
-
-        Regla de negocio:
-        El tipo de vehículo del manifiesto se toma de las etiquetas
-        del vehículo de flota seleccionado. Si hay más de una etiqueta,
-        se concatenan con un espacio entre ellas.
+    MANIFIESTO_PARTNER_SNAPSHOT_FIELDS = sorted(
+        {
+            partner_field
+            for role_map in MANIFIESTO_PARTNER_FIELD_MAP.values()
+            for partner_field in role_map.values()
+        } - {'nombre_documental'} | {'name', 'nombre_en_manifiesto'}
+    )
 
-        Ejemplo:
-        Etiquetas: [CAJA SECA, TORTON]
-        Resultado: CAJA SECA TORTON
+    @api.model
+    def _read_partner_snapshots(self, partner_ids):
         """
-        if not vehicle:
-            return ''
-
-        tag_names = []
-        seen = set()
-
-        for tag in vehicle.tag_ids:
-            name = (tag.name or '').strip()
-            key = name.lower()
-            if name and key not in seen:
-                tag_names.append(name)
-                seen.add(key)
+        Lee con un solo read() los datos que los manifiestos copian de los
+        contactos. Devuelve {partner_id: {dato: valor}}.
+        """
+        partner_ids = [partner_id for partner_id in set(partner_ids) if partner_id]
+        if not partner_ids:
+            return {}
+
+        rows = self.env['res.partner'].browse(partner_ids).read(self.MANIFIESTO_PARTNER_SNAPSHOT_FIELDS, load=None)
+        state_names = {
+            state.id: state.name
+            for state in self.env['res.country.state'].browse({row['state_id'] for row in rows if row['state_id']})
+        }
 
-        return ' '.join(tag_names)
+        snapshots = {}
+        for row in rows:
+            row['state_id'] = state_names.get(row['state_id'], '')
+            row['nombre_documental'] = (row['nombre_en_manifiesto'] or '').strip() or row['name'] or ''
+            snapshots[row['id']] = row
+        return snapshots
 
+    @api.model
+    def _get_partner_role_vals(self, role, snapshot):
+        """Valores del manifiesto para el rol `role` según MANIFIESTO_PARTNER_FIELD_MAP."""
+        snapshot = snapshot or {}
+        return {
+            manifiesto_field: snapshot.get(partner_field) or ''
+            for manifiesto_field, partner_field in MANIFIESTO_PARTNER_FIELD_MAP[role].items()
+        }
 
-    def _partner_has_responsable_tag(self, partner):
+    def _get_vehicle_tags_text(self, vehicle):
         """
-        Detecta si un contacto tiene una etiqueta/categoría tipo Responsable.
+        Devuelve el texto plano para el campo 11. Tipo de vehículo.
 
-        Usa las etiquetas estándar de contactos de Odoo: res.partner.category
-        en partner.category_id.
+        La regla vive en el campo almacenado fleet.vehicle.tipo_vehiculo_manifiesto.
         """
-        if not partner:
-            return False
-
-        for tag in partner.category_id:
-            tag_name = (tag.name or '').strip().lower()
-            if 'responsable' in tag_name:
-                return True
+        if not vehicle:
+            return ''
+        return vehicle.tipo_vehiculo_manifiesto or ''
 
-        return False
+    def _partner_has_responsable_tag(self, partner):
+        """Compatibilidad: ver res.partner._has_manifiesto_responsable_tag."""
+        return bool(partner) and partner._has_manifiesto_responsable_tag()
 
     def _get_acopio_responsable_contact(self, acopio_partner):
         """
         Devuelve el contacto responsable del Acopio/Destinatario.
 
-        Regla de negocio:
-        - Se busca primero entre los contactos hijos del destinatario/acopio.
-        - El contacto debe tener una etiqueta/categoría que contenga
-          'Responsable'.
-        - No usa contacto del generador.
-        - No usa contacto del cliente.
-        - Si no existe responsable marcado, devuelve vacío.
+        La regla vive en el campo almacenado res.partner.responsable_manifiesto_id.
         """
-        Partner = self.env['res.partner']
-
         if not acopio_partner:
-            return Partner.browse()
-
-        responsables = acopio_partner.child_ids.filtered(
-            lambda contact: self._partner_has_responsable_tag(contact)
-        )
-
-        if responsables:
-            return responsables.sorted(lambda contact: contact.id)[:1]
-
-        # Fallback controlado: si el propio destinatario/acopio está marcado como Responsable.
-        if self._partner_has_responsable_tag(acopio_partner):
-            return acopio_partner
-
-        return Partner.browse()
+            return self.env['res.partner']
+        return acopio_partner.responsable_manifiesto_id
 
     def _get_acopio_responsable_nombre(self, acopio_partner):
         responsable = self._get_acopio_responsable_contact(acopio_partner)
@@ -404,6 +468,13 @@ class ManifiestoAmbiental(models.Model):
             else:
                 record.numero_manifiesto_display = record.numero_manifiesto or ''
 
+    @api.depends('numero_manifiesto')
+    def _compute_folio_parts(self):
+        for record in self:
+            folio_base, folio_seq = record._split_auto_manifiesto_number(record.numero_manifiesto)
+            record.folio_base = folio_base
+            record.folio_seq = folio_seq
+
     @api.depends('documento_fisico')
     def _compute_tiene_documento_fisico(self):
         for record in self:
@@ -440,7 +511,7 @@ class ManifiestoAmbiental(models.Model):
             if rec.transportista_responsable_id:
                 rec.transportista_responsable_nombre = rec.transportista_responsable_id.name or ''
 
-    @api.depends('vehicle_id', 'vehicle_id.tag_ids', 'vehicle_id.tag_ids.name')
+    @api.depends('vehicle_id', 'vehicle_id.tipo_vehiculo_manifiesto')
     def _compute_vehicle_fields(self):
         for rec in self:
             rec.tipo_vehiculo = rec._get_vehicle_tags_text(rec.vehicle_id)
@@ -452,17 +523,9 @@ class ManifiestoAmbiental(models.Model):
     def _onchange_generador_id(self):
         if self.generador_id:
             p = self.generador_id
-            self.numero_registro_ambiental = p.numero_registro_ambiental or ''
-            self.generador_nombre = self._get_partner_nombre_en_manifiesto(p)
-            self.generador_codigo_postal = p.zip or ''
-            self.generador_calle = p.street or ''
-            self.generador_num_ext = p.street_number or ''
-            self.generador_num_int = p.street_number2 or ''
-            self.generador_colonia = p.street2 or ''
-            self.generador_municipio = p.city or ''
-            self.generador_estado = p.state_id.name if p.state_id else ''
-            self.generador_telefono = p.phone or ''
-            self.generador_email = p.email or ''
+            self.update(self._get_partner_role_vals(
+                'generador_id', self._read_partner_snapshots(p._origin.ids).get(p._origin.id),
+            ))
             if self.generador_responsable_id:
                 ok = (
                     self.generador_responsable_id.id == p.id or
@@ -480,18 +543,9 @@ class ManifiestoAmbiental(models.Model):
     def _onchange_transportista_id(self):
         if self.transportista_id:
             p = self.transportista_id
-            self.transportista_nombre = self._get_partner_nombre_en_manifiesto(p)
-            self.transportista_codigo_postal = p.zip or ''
-            self.transportista_calle = p.street or ''
-            self.transportista_num_ext = p.street_number or ''
-            self.transportista_num_int = p.street_number2 or ''
-            self.transportista_colonia = p.street2 or ''
-            self.transportista_municipio = p.city or ''
-            self.transportista_estado = p.state_id.name if p.state_id else ''
-            self.transportista_telefono = p.phone or ''
-            self.transportista_email = p.email or ''
-            self.numero_autorizacion_semarnat = p.numero_autorizacion_semarnat or ''
-            self.numero_permiso_sct = p.numero_permiso_sct or ''
+            self.update(self._get_partner_role_vals(
+                'transportista_id', self._read_partner_snapshots(p._origin.ids).get(p._origin.id),
+            ))
             if self.transportista_responsable_id:
                 ok = (
                     self.transportista_responsable_id.id == p.id or
@@ -518,17 +572,9 @@ class ManifiestoAmbiental(models.Model):
     def _onchange_destinatario_id(self):
         if self.destinatario_id:
             p = self.destinatario_id
-            self.destinatario_nombre = self._get_partner_nombre_en_manifiesto(p)
-            self.destinatario_codigo_postal = p.zip or ''
-            self.destinatario_calle = p.street or ''
-            self.destinatario_num_ext = p.street_number or ''
-            self.destinatario_num_int = p.street_number2 or ''
-            self.destinatario_colonia = p.street2 or ''
-            self.destinatario_municipio = p.city or ''
-            self.destinatario_estado = p.state_id.name if p.state_id else ''
-            self.destinatario_telefono = p.phone or ''
-            self.destinatario_email = p.email or ''
-            self.numero_autorizacion_semarnat_destinatario = p.numero_autorizacion_semarnat or ''
+            self.update(self._get_partner_role_vals(
+                'destinatario_id', self._read_partner_snapshots(p._origin.ids).get(p._origin.id),
+            ))
 
             responsable_nombre = self._get_acopio_responsable_nombre(p)
 
@@ -555,74 +601,89 @@ class ManifiestoAmbiental(models.Model):
         fecha = fields.Date.to_date(fecha_servicio) if fecha_servicio else False
         return fecha or fields.Date.context_today(self)
 
+    MANIFIESTO_SEQUENCE_NUMBER_SEQ = 'manifiesto_ambiental_sequence_number_seq'
+
+    def init(self):
+        """
+        Crea la secuencia de PostgreSQL de sequence_number y la adelanta al
+        máximo existente, de modo que instalar/actualizar nunca reutiliza ni
+        modifica valores ya asignados.
+        """
+        super().init()
+        seq_name = self.MANIFIESTO_SEQUENCE_NUMBER_SEQ
+        self.env.cr.execute(f"CREATE SEQUENCE IF NOT EXISTS {seq_name}")
+        self.env.cr.execute(f"""
+            SELECT setval(
+                '{seq_name}',
+                GREATEST(
+                    (SELECT COALESCE(MAX(sequence_number), 0) FROM manifiesto_ambiental),
+                    (SELECT CASE WHEN is_called THEN last_value ELSE last_value - 1 END FROM {seq_name})
+                ) + 1,
+                false
+            )
+        """)
+
     def _get_next_sequence_number(self):
         """
         Secuencia técnica global para ordenamiento interno.
 
         No se usa como sufijo del número de manifiesto.
-        Se bloquea por transacción para evitar duplicados por concurrencia.
+        Sale de una secuencia nativa de PostgreSQL: no bloquea a otros
+        creadores concurrentes (puede dejar huecos si una transacción se
+        revierte).
         """
+        return self._reserve_sequence_numbers(1)[0]
+
+    def _reserve_sequence_numbers(self, count):
+        """Reserva un bloque de `count` valores de sequence_number en una sola consulta."""
+        if count <= 0:
+            return []
+
         self.env.cr.execute(
-            "SELECT pg_advisory_xact_lock(hashtext(%s)::bigint)",
-            ['manifiesto_ambiental.sequence_number'],
-        )
-        self.env.cr.execute(
-            "SELECT COALESCE(MAX(sequence_number), 0) + 1 FROM manifiesto_ambiental"
+            "SELECT nextval(%s) FROM generate_series(1, %s)",
+            [self.MANIFIESTO_SEQUENCE_NUMBER_SEQ, count],
         )
-        return self.env.cr.fetchone()[0]
+        return [row[0] for row in self.env.cr.fetchall()]
 
     def _lock_daily_numbering(self, generador_partner, fecha_servicio=None, company_id=None):
         """
         Bloquea la numeración por generador + fecha + compañía durante la transacción.
 
         Esto evita que dos usuarios confirmen o creen simultáneamente el mismo
-        siguiente folio diario.
+        siguiente folio diario. El bloqueo es el de la fila del contador
+        `manifiesto.ambiental.folio.counter`, que se devuelve ya bloqueada.
         """
         if not generador_partner:
-            return
+            return self.env['manifiesto.ambiental.folio.counter']
 
         fecha = self._normalize_manifiesto_date(fecha_servicio)
         company_id = company_id.id if hasattr(company_id, 'id') else company_id
         company_id = company_id or self.env.company.id
 
-        lock_key = "manifiesto_ambiental.daily.%s.%s.%s" % (
+        return self.env['manifiesto.ambiental.folio.counter']._get_locked(
             company_id,
-            generador_partner.id,
-            fecha.isoformat(),
-        )
-        self.env.cr.execute(
-            "SELECT pg_advisory_xact_lock(hashtext(%s)::bigint)",
-            [lock_key],
+            generador_partner,
+            fecha,
         )
 
     def _get_manifiesto_initials(self, generador_partner):
+        """
+        Iniciales del folio. Se leen del campo almacenado
+        res.partner.manifiesto_iniciales; el cálculo desde la razón social
+        solo se usa si el contacto aún no las tiene.
+        """
         if not generador_partner:
             raise UserError("Se requiere un generador para crear el número de manifiesto.")
 
-        razon_social = (generador_partner.name or '').upper().strip()
-        if not razon_social:
-            raise UserError("El generador debe tener nombre para crear el número de manifiesto.")
+        iniciales = (generador_partner.manifiesto_iniciales or '').strip().upper()
+        if iniciales:
+            return iniciales
 
-        palabras_excluir = [
-            'S.A.', 'SA', 'S.A', 'DE', 'C.V.', 'CV', 'C.V', 'S.A.P.I.', 'SAPI',
-            'S. DE R.L.', 'S.R.L.', 'SRL', 'SOCIEDAD', 'ANONIMA', 'ANÓNIMA',
-            'CIVIL', 'RESPONSABILIDAD', 'LIMITADA', 'CAPITAL', 'VARIABLE',
-            'Y', 'E', 'LA', 'EL', 'LOS', 'LAS', 'DEL', 'CON', 'SIN', 'PARA', 'POR',
-        ]
-
-        razon_limpia = re.sub(r'[^\w\s]', ' ', razon_social)
-        palabras = razon_limpia.split()
-        palabras_significativas = [
-            p for p in palabras
-            if p not in palabras_excluir and len(p) > 1
-        ]
-
-        if len(palabras_significativas) >= 2:
-            return palabras_significativas[0][0] + palabras_significativas[1][0]
-        if len(palabras_significativas) == 1:
-            return palabras_significativas[0][:2]
+        iniciales = generador_partner._get_manifiesto_iniciales_from_name(generador_partner.name)
+        if not iniciales:
+            raise UserError("El generador debe tener nombre para crear el número de manifiesto.")
 
-        return razon_social[:2]
+        return iniciales
 
     def _get_manifiesto_number_base(self, generador_partner, fecha_servicio=None):
         fecha = self._normalize_manifiesto_date(fecha_servicio)
@@ -630,6 +691,24 @@ class ManifiestoAmbiental(models.Model):
         iniciales = self._get_manifiesto_initials(generador_partner)
         return f"{iniciales}-{fecha_str}"
 
+    def _split_auto_manifiesto_number(self, numero_manifiesto):
+        """
+        Separa un folio automático en (base, consecutivo):
+        - AB-27052026    -> ('AB-27052026', 1)
+        - AB-27052026-02 -> ('AB-27052026', 2)
+
+        Si no tiene forma de folio automático devuelve (False, 0).
+        """
+        match = MANIFIESTO_AUTO_FOLIO_RE.match((numero_manifiesto or '').strip().upper())
+        if not match:
+            return False, 0
+
+        seq = int(match.group(5)) if match.group(5) else 1
+        if seq <= 0:
+            return False, 0
+
+        return match.group(1), seq
+
     def _parse_manifiesto_sequence(self, numero_manifiesto, numero_base):
         """
         Convierte:
@@ -639,25 +718,13 @@ class ManifiestoAmbiental(models.Model):
 
         Si no coincide con la base automática, devuelve None.
         """
-        numero = (numero_manifiesto or '').strip().upper()
         base = (numero_base or '').strip().upper()
+        folio_base, seq = self._split_auto_manifiesto_number(numero_manifiesto)
 
-        if not numero or not base:
-            return None
-
-        match = re.match(
-            r'^%s(?:-(\d+))?$' % re.escape(base),
-            numero,
-            flags=re.IGNORECASE,
-        )
-        if not match:
+        if not base or folio_base != base:
             return None
 
-        if not match.group(1):
-            return 1
-
-        seq = int(match.group(1))
-        return seq if seq > 0 else None
+        return seq
 
     def _looks_like_auto_manifiesto_number(self, numero_manifiesto):
         """
@@ -672,7 +739,7 @@ class ManifiestoAmbiental(models.Model):
         Un número completamente personalizado no se toca al confirmar.
         """
         numero = (numero_manifiesto or '').strip().upper()
-        return bool(re.match(r'^[\w]{1,4}-\d{8}(?:-\d+)?$', numero))
+        return bool(MANIFIESTO_AUTO_FOLIO_RE.match(numero))
 
     def _format_manifiesto_number(self, numero_base, sequence):
         """
@@ -699,9 +766,9 @@ class ManifiestoAmbiental(models.Model):
         company_id = company_id or self.env.company.id
 
         domain = [
-            ('numero_manifiesto', '=like', f'{numero_base}%'),
-            ('generador_id', '=', generador_partner.id),
             ('company_id', '=', company_id),
+            ('generador_id', '=', generador_partner.id),
+            ('folio_base', '=', numero_base),
         ]
 
         if states:
@@ -720,7 +787,12 @@ class ManifiestoAmbiental(models.Model):
         states=None,
         exclude_id=None,
     ):
-        numero_base = self._get_manifiesto_number_base(generador_partner, fecha_servicio)
+        """
+        Escanea los folios existentes del generador/día.
+
+        La numeración usa el contador `manifiesto.ambiental.folio.counter`;
+        este escaneo solo se usa para inicializar un contador nuevo.
+        """
         domain = self._get_daily_sequence_domain(
             generador_partner=generador_partner,
             fecha_servicio=fecha_servicio,
@@ -729,16 +801,11 @@ class ManifiestoAmbiental(models.Model):
             exclude_id=exclude_id,
         )
 
-        used = set()
-        for manifiesto in self.search(domain):
-            seq = self._parse_manifiesto_sequence(
-                manifiesto.numero_manifiesto,
-                numero_base,
-            )
-            if seq:
-                used.add(seq)
-
-        return used
+        return {
+            manifiesto.folio_seq
+            for manifiesto in self.search_fetch(domain, ['folio_seq'])
+            if manifiesto.folio_seq
+        }
 
     def _get_next_daily_sequence(
         self,
@@ -777,6 +844,10 @@ class ManifiestoAmbiental(models.Model):
         sequence_num se conserva en la firma por retrocompatibilidad, pero ya
         no se usa como sufijo documental. El bug venía de usar una secuencia
         global como si fuera la secuencia diaria del cliente.
+
+        El consecutivo se toma del contador diario (queda reservado en la
+        transacción); states y exclude_id ya no intervienen y solo se
+        conservan por compatibilidad de firma.
         """
         if not generador_partner:
             raise UserError("Se requiere un generador para crear el número de manifiesto.")
@@ -785,175 +856,418 @@ class ManifiestoAmbiental(models.Model):
         company_id = company_id.id if hasattr(company_id, 'id') else company_id
         company_id = company_id or self.env.company.id
 
-        self._lock_daily_numbering(generador_partner, fecha, company_id)
+        counter = self._lock_daily_numbering(generador_partner, fecha, company_id)
 
         numero_base = self._get_manifiesto_number_base(generador_partner, fecha)
 
-        next_seq = self._get_next_daily_sequence(
-            generador_partner=generador_partner,
-            fecha_servicio=fecha,
-            company_id=company_id,
-            states=states or self.MANIFIESTO_ACTIVE_SEQUENCE_STATES,
-            exclude_id=exclude_id,
+        return self._format_manifiesto_number(numero_base, counter._take_sequence())
+
+    def _parse_auto_manifiesto_date(self, numero_manifiesto):
+        """Extrae la fecha DDMMYYYY de un folio automático, o None."""
+        match = MANIFIESTO_AUTO_FOLIO_RE.match((numero_manifiesto or '').strip().upper())
+        if not match:
+            return None
+
+        day, month, year = (int(part) for part in match.group(2, 3, 4))
+        try:
+            return fields.Date.to_date('%04d-%02d-%02d' % (year, month, day))
+        except ValueError:
+            return None
+
+    def _get_daily_folio_key(self, fecha=None):
+        """
+        Devuelve (fecha, numero_base, consecutivo) del folio actual respecto a
+        su generador. Si se indica `fecha`, se interpreta contra esa fecha en
+        lugar de generador_fecha.
+        """
+        self.ensure_one()
+        fecha = self._normalize_manifiesto_date(fecha or self.generador_fecha)
+        numero_base = self._get_manifiesto_number_base(self.generador_id, fecha)
+        seq = self.folio_seq if self.folio_base and self.folio_base == numero_base else None
+        return fecha, numero_base, seq
+
+    def _get_daily_folio_holders(self, exclude_ids=None, states=None):
+        """
+        Otros manifiestos que ocupan el mismo consecutivo diario que este
+        (misma base y consecutivo). Usa el índice de componentes del folio.
+        """
+        self.ensure_one()
+        if not self.folio_base:
+            return self.browse()
+
+        domain = [
+            ('company_id', '=', self.company_id.id or self.env.company.id),
+            ('generador_id', '=', self.generador_id.id),
+            ('folio_base', '=', self.folio_base),
+            ('folio_seq', '=', self.folio_seq),
+            ('state', 'in', list(states or self.MANIFIESTO_ACTIVE_SEQUENCE_STATES)),
+        ]
+        if exclude_ids:
+            domain.append(('id', 'not in', list(exclude_ids)))
+        return self.search(domain, limit=1)
+
+    def _lock_daily_numbering_keys(self, keys):
+        """
+        Bloquea los contadores de varias llaves (company_id, generador_id, fecha)
+        siempre en el mismo orden. Dos lotes que se traslapan esperan uno al
+        otro en lugar de bloquearse mutuamente (deadlock).
+
+        Devuelve {llave: contador bloqueado}.
+        """
+        Partner = self.env['res.partner']
+        return {
+            key: self._lock_daily_numbering(Partner.browse(key[1]), key[2], key[0])
+            for key in sorted(set(keys))
+        }
+
+    def _get_folio_counter_entries(self):
+        """
+        Lista de (llave, manifiesto, consecutivo) de los folios automáticos
+        activos de estos manifiestos, según la fecha escrita en el propio folio.
+        """
+        entries = []
+        for rec in self:
+            if rec.state not in self.MANIFIESTO_ACTIVE_SEQUENCE_STATES or not rec.generador_id:
+                continue
+
+            fecha = rec._parse_auto_manifiesto_date(rec.numero_manifiesto)
+            fecha, _numero_base, seq = rec._get_daily_folio_key(fecha)
+            if seq:
+                key = (rec.company_id.id or self.env.company.id, rec.generador_id.id, fecha)
+                entries.append((key, rec, seq))
+        return entries
+
+    def _get_folio_counter_key(self, company_id, generador_id, numero_manifiesto, generador_fecha=None):
+        """
+        Llave (company_id, generador_id, fecha) del contador que ocuparía un
+        folio, o None si el número no tiene forma de folio automático.
+        """
+        if not generador_id or not self._looks_like_auto_manifiesto_number(numero_manifiesto):
+            return None
+        fecha = (
+            self._parse_auto_manifiesto_date(numero_manifiesto)
+            or self._normalize_manifiesto_date(generador_fecha)
         )
+        return (company_id or self.env.company.id, generador_id, fecha)
+
+    def _get_folio_counter_keys_for_write(self, vals):
+        """
+        Llaves del contador que tocará la escritura de `vals`: las de los
+        folios actuales (se liberan) y las de los folios resultantes (se
+        ocupan). Se bloquean juntas antes de escribir para que el orden de
+        bloqueo sea siempre el mismo.
+        """
+        keys = {key for key, _rec, _seq in self._get_folio_counter_entries()}
+        state = vals.get('state')
+        for rec in self:
+            if (state or rec.state) not in self.MANIFIESTO_ACTIVE_SEQUENCE_STATES:
+                continue
+            key = self._get_folio_counter_key(
+                vals['company_id'] if 'company_id' in vals else rec.company_id.id,
+                vals['generador_id'] if 'generador_id' in vals else rec.generador_id.id,
+                vals['numero_manifiesto'] if 'numero_manifiesto' in vals else rec.numero_manifiesto,
+                vals['generador_fecha'] if 'generador_fecha' in vals else rec.generador_fecha,
+            )
+            if key:
+                keys.add(key)
+        return keys
 
-        return self._format_manifiesto_number(numero_base, next_seq)
+    def _release_daily_folios(self):
+        """
+        Devuelve al contador diario los consecutivos de estos manifiestos
+        (cancelación, borrado, cambio de folio o de generador).
+
+        Si otra versión activa comparte el folio (remanifestación), el
+        consecutivo sigue en uso y no se libera.
+        """
+        entries = [
+            (key, rec, seq)
+            for key, rec, seq in self._get_folio_counter_entries()
+            if not rec._get_daily_folio_holders(exclude_ids=self.ids)
+        ]
+        counters = self._lock_daily_numbering_keys(key for key, _rec, _seq in entries)
+        for key, _rec, seq in entries:
+            counters[key]._release_sequence(seq)
+
+    def _claim_daily_folios(self):
+        """Marca como usados en el contador los folios capturados que siguen la base automática."""
+        entries = self._get_folio_counter_entries()
+        counters = self._lock_daily_numbering_keys(key for key, _rec, _seq in entries)
+        for key, _rec, seq in entries:
+            counters[key]._claim_sequence(seq)
+
+    def _reconcile_folio_leases(self):
+        """
+        Concilia los manifiestos sincronizados con su préstamo de folios.
+        Devuelve los que no vienen de un préstamo vigente.
+        """
+        unleased = self.browse()
+        for lease in self.folio_lease_id:
+            unleased |= lease._reconcile_manifiestos(self.filtered(lambda m: m.folio_lease_id == lease))
+        return unleased
+
+    def _holds_leased_folio(self):
+        """
+        True si el folio del manifiesto salió de su préstamo. Vale aunque el
+        préstamo ya se haya devuelto: el folio está escrito en el formato en
+        papel y no debe moverse a un consecutivo liberado después.
+        """
+        self.ensure_one()
+        lease = self.folio_lease_id
+        return bool(lease) and lease._holds_folio(self)
 
     def _assign_daily_number_on_confirm(self):
+        """Asigna el folio oficial de un manifiesto. Ver _assign_daily_numbers_on_confirm."""
+        self.ensure_one()
+        self._assign_daily_numbers_on_confirm()
+
+    def _assign_daily_numbers_on_confirm(self):
         """
         Al confirmar, el número se vuelve oficial.
 
         Reglas:
         - Si es remanifestación, conserva el número original.
         - Si el folio fue capturado/corregido manualmente, no se toca.
+        - Si el folio viene de un préstamo (captura sin conexión), no se toca,
+          aunque el préstamo ya se haya devuelto: el consecutivo se reservó
+          en el contador y ya está en el formato en papel.
         - Si el número es personalizado y no parece automático, no se toca.
-        - Si el número automático está duplicado o saltado, se ajusta al
-          siguiente consecutivo real para ese generador/día/compañía.
+        - Si el número automático está duplicado con otro ya oficial, quedó
+          fuera de la base del generador/fecha (p. ej. se cambió la fecha) o
+          existe un consecutivo liberado menor, se ajusta usando el contador
+          diario del generador/día/compañía.
+
+        Funciona por lote: todos los contadores involucrados se bloquean al
+        inicio en orden fijo de llave, y los consecutivos ya oficiales de cada
+        grupo se leen con una sola consulta.
         """
-        self.ensure_one()
-
-        if self.created_by_remanifest or self.version > 1:
+        candidates = self.filtered(
+            lambda m: not m.created_by_remanifest
+            and m.version <= 1
+            and not m.numero_manifiesto_manual
+            and m.generador_id
+            and not m._holds_leased_folio()
+            # folio_base vacío = número personalizado, no se mantiene consecutivo.
+            and m.folio_base
+        )
+        if not candidates:
             return
 
-        if self.numero_manifiesto_manual:
-            return
+        groups = defaultdict(list)
+        drifted = self.browse()
+        for rec in candidates:
+            fecha, numero_base, current_seq = rec._get_daily_folio_key()
+            key = (rec.company_id.id or self.env.company.id, rec.generador_id.id, fecha)
+            groups[key].append((rec, numero_base, current_seq))
+            if current_seq is None:
+                drifted |= rec
+
+        # Folios automáticos de otra fecha: también se bloquea su contador de
+        # origen para liberarlos antes de tomar uno en el contador vigente.
+        drift_keys = [key for key, _rec, _seq in drifted._get_folio_counter_entries()]
+        counters = self._lock_daily_numbering_keys(list(groups) + drift_keys)
+        drifted._release_daily_folios()
+
+        for key in sorted(groups):
+            company_id, generador_id, _fecha = key
+            counter = counters[key]
+            items = groups[key]
+            numero_base = items[0][1]
+
+            official_seqs = {
+                manifiesto.folio_seq
+                for manifiesto in self.search_fetch([
+                    ('company_id', '=', company_id),
+                    ('generador_id', '=', generador_id),
+                    ('folio_base', '=', numero_base),
+                    ('state', 'in', list(self.MANIFIESTO_OFFICIAL_SEQUENCE_STATES)),
+                    ('id', 'not in', candidates.ids),
+                ], ['folio_seq'])
+            }
 
-        if not self.generador_id:
-            return
+            for rec, _numero_base, current_seq in sorted(
+                items,
+                key=lambda item: (item[2] is None, item[2] or 0, item[0].id),
+            ):
+                if current_seq is None or current_seq in official_seqs:
+                    # Folio de otra fecha o consecutivo duplicado con uno oficial.
+                    desired_seq = counter._take_sequence()
+                else:
+                    counter._claim_sequence(current_seq)
+                    desired_seq = counter._compact_sequence(current_seq)
+                official_seqs.add(desired_seq)
 
-        fecha = self._normalize_manifiesto_date(self.generador_fecha)
-        company_id = self.company_id.id or self.env.company.id
+                desired_number = self._format_manifiesto_number(numero_base, desired_seq)
+                if rec.numero_manifiesto != desired_number:
+                    # ma_auto_folio: esta escritura es del sistema, no debe marcar
+                    # el folio como manual.
+                    rec.with_context(ma_auto_folio=True).write({'numero_manifiesto': desired_number})
 
-        numero_base = self._get_manifiesto_number_base(self.generador_id, fecha)
+    # =========================================================================
+    # CREATE
+    # =========================================================================
+    MANIFIESTO_PARTNER_ROLE_FIELDS = (
+        'generador_id',
+        'transportista_id',
+        'destinatario_id',
+        'generador_responsable_id',
+        'transportista_responsable_id',
+    )
 
-        current_seq = self._parse_manifiesto_sequence(
-            self.numero_manifiesto,
-            numero_base,
-        )
+    # Los datos que se copian al manifiesto se leen aparte con
+    # _read_partner_snapshots; aquí solo lo que usan el folio y los responsables.
+    MANIFIESTO_PARTNER_PREFETCH_FIELDS = [
+        'name',
+        'manifiesto_iniciales',
+        'responsable_manifiesto_id',
+    ]
 
-        if current_seq is None and not self._looks_like_auto_manifiesto_number(self.numero_manifiesto):
-            # Número completamente personalizado. No mantener consecutivo.
-            return
+    def _prefetch_create_references(self, vals_list):
+        """
+        Lee en bloque los contactos y vehículos referenciados por vals_list.
+
+        Devuelve dos diccionarios id -> registro. Los registros comparten el
+        mismo conjunto de prefetch, así que leer sus campos no genera una
+        consulta por manifiesto.
+        """
+        partner_ids = {
+            vals[field_name]
+            for vals in vals_list
+            for field_name in self.MANIFIESTO_PARTNER_ROLE_FIELDS
+            if vals.get(field_name)
+        }
+        partners = self.env['res.partner'].browse(partner_ids)
+        partners.fetch(self.MANIFIESTO_PARTNER_PREFETCH_FIELDS)
+        partners.responsable_manifiesto_id.mapped('name')
 
-        self._lock_daily_numbering(self.generador_id, fecha, company_id)
+        vehicle_ids = {vals['vehicle_id'] for vals in vals_list if vals.get('vehicle_id')}
+        vehicles = self.env['fleet.vehicle'].browse(vehicle_ids).exists()
+        vehicles.fetch(['tipo_vehiculo_manifiesto'])
 
-        desired_seq = self._get_next_daily_sequence(
-            generador_partner=self.generador_id,
-            fecha_servicio=fecha,
-            company_id=company_id,
-            states=self.MANIFIESTO_OFFICIAL_SEQUENCE_STATES,
-            exclude_id=self.id,
+        return (
+            {partner.id: partner for partner in partners},
+            {vehicle.id: vehicle for vehicle in vehicles},
         )
-        desired_number = self._format_manifiesto_number(numero_base, desired_seq)
 
-        if self.numero_manifiesto != desired_number:
-            # ma_auto_folio: esta escritura es del sistema, no debe marcar
-            # el folio como manual.
-            self.with_context(ma_auto_folio=True).write({'numero_manifiesto': desired_number})
+    def _assign_create_folios(self, vals_list, partners_by_id):
+        """
+        Asigna los folios automáticos de un lote de creación.
+
+        Agrupa por (compañía, generador, fecha), bloquea cada contador una sola
+        vez, en orden fijo de llave, y toma el rango completo del grupo.
+        """
+        groups = defaultdict(list)
+        for vals in vals_list:
+            if vals.get('created_by_remanifest') or vals.get('numero_manifiesto') or not vals.get('generador_id'):
+                continue
+            fecha = self._normalize_manifiesto_date(vals.get('generador_fecha'))
+            company_id = vals.get('company_id') or self.env.company.id
+            groups[(company_id, vals['generador_id'], fecha)].append(vals)
+
+        # Los folios capturados del lote se ocupan después del create; sus
+        # contadores se bloquean aquí junto con los automáticos para que todo
+        # el lote tome sus bloqueos en un solo orden.
+        captured_keys = [
+            self._get_folio_counter_key(
+                vals.get('company_id'), vals.get('generador_id'),
+                vals['numero_manifiesto'], vals.get('generador_fecha'),
+            )
+            for vals in vals_list
+            if vals.get('numero_manifiesto') and not vals.get('created_by_remanifest')
+        ]
+        counters = self._lock_daily_numbering_keys(list(groups) + [key for key in captured_keys if key])
+
+        for key in sorted(groups):
+            company_id, generador_id, fecha = key
+            generador_partner = partners_by_id[generador_id]
+            group_vals = groups[key]
+
+            counter = counters[key]
+            numero_base = self._get_manifiesto_number_base(generador_partner, fecha)
+
+            for vals, seq in zip(group_vals, counter._take_sequences(len(group_vals))):
+                vals['numero_manifiesto'] = self._format_manifiesto_number(numero_base, seq)
 
-    # =========================================================================
-    # CREATE
-    # =========================================================================
     @api.model_create_multi
     def create(self, vals_list):
+        reserved_numbers = iter(self._reserve_sequence_numbers(len([
+            vals for vals in vals_list
+            if not vals.get('created_by_remanifest') and not vals.get('sequence_number')
+        ])))
+
+        partners_by_id, vehicles_by_id = self._prefetch_create_references(vals_list)
+        snapshots = self._read_partner_snapshots(
+            vals[role] for vals in vals_list for role in MANIFIESTO_PARTNER_FIELD_MAP if vals.get(role)
+        )
+
         for vals in vals_list:
             if not vals.get('created_by_remanifest'):
-                next_seq = self._get_next_sequence_number()
-                vals['sequence_number'] = vals.get('sequence_number') or next_seq
+                vals['sequence_number'] = vals.get('sequence_number') or next(reserved_numbers)
 
-                if vals.get('numero_manifiesto') and 'numero_manifiesto_manual' not in vals:
+                if (
+                    vals.get('numero_manifiesto')
+                    and 'numero_manifiesto_manual' not in vals
+                    and not vals.get('folio_lease_id')
+                ):
                     # El número no fue generado por el sistema: es un folio
                     # capturado (usuario, salida de acopio, etc.) y debe
                     # respetarse en confirmación y remanifestaciones.
                     vals['numero_manifiesto_manual'] = True
 
-                if not vals.get('numero_manifiesto'):
-                    generador_id = vals.get('generador_id')
-                    if generador_id:
-                        generador_partner = self.env['res.partner'].browse(generador_id)
-                        vals['numero_manifiesto'] = self._generate_manifiesto_number(
-                            generador_partner=generador_partner,
-                            fecha_servicio=vals.get('generador_fecha'),
-                            company_id=vals.get('company_id') or self.env.company.id,
-                            states=self.MANIFIESTO_ACTIVE_SEQUENCE_STATES,
-                        )
-                    else:
-                        vals['numero_manifiesto'] = str(vals['sequence_number'])
-
-            if vals.get('generador_id'):
-                p = self.env['res.partner'].browse(vals['generador_id'])
-                vals.update({
-                    'numero_registro_ambiental': vals.get('numero_registro_ambiental') or p.numero_registro_ambiental or '',
-                    'generador_nombre': vals.get('generador_nombre') or self._get_partner_nombre_en_manifiesto(p),
-                    'generador_codigo_postal': vals.get('generador_codigo_postal') or p.zip or '',
-                    'generador_calle': vals.get('generador_calle') or p.street or '',
-                    'generador_num_ext': vals.get('generador_num_ext') or p.street_number or '',
-                    'generador_num_int': vals.get('generador_num_int') or p.street_number2 or '',
-                    'generador_colonia': vals.get('generador_colonia') or p.street2 or '',
-                    'generador_municipio': vals.get('generador_municipio') or p.city or '',
-                    'generador_estado': vals.get('generador_estado') or (p.state_id.name if p.state_id else ''),
-                    'generador_telefono': vals.get('generador_telefono') or p.phone or '',
-                    'generador_email': vals.get('generador_email') or p.email or '',
-                })
-
-            if vals.get('transportista_id'):
-                p = self.env['res.partner'].browse(vals['transportista_id'])
-                vals.update({
-                    'transportista_nombre': vals.get('transportista_nombre') or self._get_partner_nombre_en_manifiesto(p),
-                    'transportista_codigo_postal': vals.get('transportista_codigo_postal') or p.zip or '',
-                    'transportista_calle': vals.get('transportista_calle') or p.street or '',
-                    'transportista_num_ext': vals.get('transportista_num_ext') or p.street_number or '',
-                    'transportista_num_int': vals.get('transportista_num_int') or p.street_number2 or '',
-                    'transportista_colonia': vals.get('transportista_colonia') or p.street2 or '',
-                    'transportista_municipio': vals.get('transportista_municipio') or p.city or '',
-                    'transportista_estado': vals.get('transportista_estado') or (p.state_id.name if p.state_id else ''),
-                    'transportista_telefono': vals.get('transportista_telefono') or p.phone or '',
-                    'transportista_email': vals.get('transportista_email') or p.email or '',
-                    'numero_autorizacion_semarnat': vals.get('numero_autorizacion_semarnat') or p.numero_autorizacion_semarnat or '',
-                    'numero_permiso_sct': vals.get('numero_permiso_sct') or p.numero_permiso_sct or '',
-                })
+        self._assign_create_folios(vals_list, partners_by_id)
+
+        for vals in vals_list:
+            if not vals.get('created_by_remanifest') and not vals.get('numero_manifiesto'):
+                vals['numero_manifiesto'] = str(vals['sequence_number'])
+
+            for role in MANIFIESTO_PARTNER_FIELD_MAP:
+                if vals.get(role):
+                    for field_name, value in self._get_partner_role_vals(role, snapshots.get(vals[role])).items():
+                        vals[field_name] = vals.get(field_name) or value
 
             if vals.get('destinatario_id'):
-                p = self.env['res.partner'].browse(vals['destinatario_id'])
+                p = partners_by_id[vals['destinatario_id']]
                 responsable_nombre = self._get_acopio_responsable_nombre(p)
 
-                vals.update({
-                    'destinatario_nombre': vals.get('destinatario_nombre') or self._get_partner_nombre_en_manifiesto(p),
-                    'destinatario_codigo_postal': vals.get('destinatario_codigo_postal') or p.zip or '',
-                    'destinatario_calle': vals.get('destinatario_calle') or p.street or '',
-                    'destinatario_num_ext': vals.get('destinatario_num_ext') or p.street_number or '',
-                    'destinatario_num_int': vals.get('destinatario_num_int') or p.street_number2 or '',
-                    'destinatario_colonia': vals.get('destinatario_colonia') or p.street2 or '',
-                    'destinatario_municipio': vals.get('destinatario_municipio') or p.city or '',
-                    'destinatario_estado': vals.get('destinatario_estado') or (p.state_id.name if p.state_id else ''),
-                    'destinatario_telefono': vals.get('destinatario_telefono') or p.phone or '',
-                    'destinatario_email': vals.get('destinatario_email') or p.email or '',
-                    'numero_autorizacion_semarnat_destinatario': vals.get('numero_autorizacion_semarnat_destinatario') or p.numero_autorizacion_semarnat or '',
-
-                    # Sección Destinatario/Acopio:
-                    # solo se llena desde contacto de Acopio con etiqueta Responsable.
-                    'nombre_persona_recibe': vals.get('nombre_persona_recibe') or responsable_nombre,
-                    'destinatario_responsable_nombre': vals.get('destinatario_responsable_nombre') or responsable_nombre,
-                })
+                # Sección Destinatario/Acopio:
+                # solo se llena desde contacto de Acopio con etiqueta Responsable.
+                vals['nombre_persona_recibe'] = vals.get('nombre_persona_recibe') or responsable_nombre
+                vals['destinatario_responsable_nombre'] = vals.get('destinatario_responsable_nombre') or responsable_nombre
 
             if vals.get('generador_responsable_id') and not vals.get('generador_responsable_nombre'):
-                r = self.env['res.partner'].browse(vals['generador_responsable_id'])
+                r = partners_by_id[vals['generador_responsable_id']]
                 vals['generador_responsable_nombre'] = r.name or ''
 
             if vals.get('transportista_responsable_id') and not vals.get('transportista_responsable_nombre'):
-                r = self.env['res.partner'].browse(vals['transportista_responsable_id'])
+                r = partners_by_id[vals['transportista_responsable_id']]
                 vals['transportista_responsable_nombre'] = r.name or ''
 
-            if vals.get('vehicle_id'):
-                vehicle = self.env['fleet.vehicle'].browse(vals['vehicle_id'])
-                if vehicle.exists():
-                    vals['tipo_vehiculo'] = self._get_vehicle_tags_text(vehicle)
+            vehicle = vehicles_by_id.get(vals.get('vehicle_id'))
+            if vehicle:
+                vals['tipo_vehiculo'] = self._get_vehicle_tags_text(vehicle)
 
         records = super().create(vals_list)
 
-        for record in records:
-            if not record.original_manifiesto_id:
-                record.original_manifiesto_id = record.id
+        without_original = records.filtered(lambda r: not r.original_manifiesto_id)
+        if without_original:
+            self.env.cr.execute(
+                "UPDATE manifiesto_ambiental SET original_manifiesto_id = id WHERE id IN %s",
+                [tuple(without_original.ids)],
+            )
+            without_original.invalidate_recordset(['original_manifiesto_id'])
+
+        # Folios de un bloque prestado: ya están tomados en el contador, solo
+        # se marcan como usados en el préstamo. Los que no corresponden a un
+        # préstamo vigente se tratan como folios capturados.
+        unleased = records.filtered('folio_lease_id')._reconcile_folio_leases()
+        if unleased:
+            unleased.write({'numero_manifiesto_manual': True})
+
+        # Los folios capturados que siguen la base automática ocupan su
+        # consecutivo en el contador diario.
+        records.filtered(
+            lambda r: r.numero_manifiesto_manual and not r.created_by_remanifest
+        )._claim_daily_folios()
 
         return records
 
@@ -998,27 +1312,42 @@ class ManifiestoAmbiental(models.Model):
             if 'destinatario_responsable_nombre' not in vals:
                 vals['destinatario_responsable_nombre'] = responsable_nombre
 
+        # Contador de folios diarios: liberar los consecutivos que dejan de
+        # estar en uso antes de escribir (con los valores anteriores) y
+        # ocupar los nuevos después. Las escrituras de ma_auto_folio vienen de
+        # la confirmación, que ya mantiene el contador.
+        folio_changed = self.browse()
+        if not self.env.context.get('ma_auto_folio'):
+            if 'numero_manifiesto' in vals:
+                folio_changed |= self.filtered(lambda m: m.numero_manifiesto != vals['numero_manifiesto'])
+            if 'generador_id' in vals:
+                folio_changed |= self.filtered(lambda m: m.generador_id.id != (vals['generador_id'] or False))
+            if 'company_id' in vals:
+                folio_changed |= self.filtered(lambda m: m.company_id.id != (vals['company_id'] or False))
+            if vals.get('state') == 'cancel':
+                folio_changed |= self.filtered(lambda m: m.state != 'cancel')
+            elif vals.get('state') in self.MANIFIESTO_ACTIVE_SEQUENCE_STATES:
+                # Al salir de cancelado el folio vuelve a estar en uso: se
+                # ocupa de nuevo después de escribir para que el contador no
+                # lo entregue a otro manifiesto.
+                folio_changed |= self.filtered(lambda m: m.state == 'cancel')
+        if folio_changed:
+            # Liberar y ocupar en dos pasos tomaría los bloqueos en dos
+            # órdenes distintos; se bloquea la unión de llaves una sola vez.
+            self._lock_daily_numbering_keys(folio_changed._get_folio_counter_keys_for_write(vals))
+        folio_changed._release_daily_folios()
+
         res = super().write(vals)
 
-        if 'numero_manifiesto' in vals:
-            new_number = vals['numero_manifiesto']
-            for manifiesto in self:
-                for residuo in manifiesto.residuo_ids:
-                    if not residuo.product_id or not new_number:
-                        continue
-                    existing_lot = self.env['stock.lot'].search([
-                        ('name', '=', new_number),
-                        ('product_id', '=', residuo.product_id.id),
-                        ('company_id', '=', manifiesto.company_id.id),
-                    ], limit=1)
-                    if existing_lot:
-                        residuo.lot_id = existing_lot
-                    else:
-                        residuo.lot_id = self.env['stock.lot'].create({
-                            'name': new_number,
-                            'product_id': residuo.product_id.id,
-                            'company_id': manifiesto.company_id.id,
-                        })
+        folio_changed._claim_daily_folios()
+
+        if 'numero_manifiesto' in vals and vals['numero_manifiesto']:
+            # Lotes del nuevo folio para todas las líneas de todos los
+            # manifiestos: una búsqueda, un create y una escritura por lote.
+            # Con creación diferida solo se renombran las líneas que ya
+            # tienen lote o cuyo manifiesto ya lo requiere.
+            residuos = self._filter_lot_ready().residuo_ids | self.residuo_ids.filtered('lot_id')
+            residuos._assign_folio_lots()
         return res
 
     # =========================================================================
@@ -1097,25 +1426,70 @@ class ManifiestoAmbiental(models.Model):
     # =========================================================================
     # ACCIONES DE ESTADO
     # =========================================================================
+    def _write_state(self, state):
+        """
+        Cambia el estado de todos los manifiestos con una sola escritura.
+
+        En modo masivo (contexto manifiesto_bulk_transition) se omite el
+        seguimiento campo por campo de mail.thread y se registra una sola nota
+        por manifiesto, creada en lote y sin notificar a los seguidores.
+        """
+        if not self:
+            return True
+
+        if not self.env.context.get('manifiesto_bulk_transition'):
+            return self.write({'state': state})
+
+        labels = dict(self._fields['state']._description_selection(self.env))
+        old_states = {rec.id: rec.state for rec in self}
+        res = self.with_context(tracking_disable=True).write({'state': state})
+        self._message_log_batch(bodies={
+            rec.id: _(
+                "Estado: %(old)s → %(new)s (cambio masivo)",
+                old=labels.get(old_states[rec.id], old_states[rec.id]),
+                new=labels[state],
+            )
+            for rec in self
+        })
+        return res
+
+    # Cada transición solo aplica desde los estados en que el formulario
+    # muestra su botón; los demás manifiestos de la selección se omiten
+    # (p. ej. en las acciones masivas de la lista).
+    def _filter_state(self, *states):
+        return self.filtered(lambda m: m.state in states)
+
     def action_confirm(self):
-        for rec in self:
-            if rec.state == 'draft':
-                rec._assign_daily_number_on_confirm()
-            rec.state = 'confirmed'
+        drafts = self._filter_state('draft')
+        drafts._assign_daily_numbers_on_confirm()
+        drafts._write_state('confirmed')
+        if drafts and self._get_lot_creation_mode() == 'confirm':
+            drafts._materialize_folio_lots()
 
     def action_in_transit(self):
-        for rec in self:
-            rec.state = 'in_transit'
+        self._filter_state('confirmed')._write_state('in_transit')
 
     def action_delivered(self):
-        for rec in self:
-            rec.state = 'delivered'
-            if rec.es_transito_directo:
-                rec._crear_transito_directo()
+        delivered = self._filter_state('in_transit')
+        delivered._write_state('delivered')
+        for rec in delivered.filtered('es_transito_directo'):
+            rec._crear_transito_directo()
 
     def action_cancel(self):
-        for rec in self:
-            rec.state = 'cancel'
+        self._filter_state('draft', 'confirmed', 'in_transit')._write_state('cancel')
+
+    def action_confirm_bulk(self):
+        return self.with_context(manifiesto_bulk_transition=True).action_confirm()
+
+    def action_in_transit_bulk(self):
+        return self.with_context(manifiesto_bulk_transition=True).action_in_transit()
+
+    def action_delivered_bulk(self):
+        return self.with_context(manifiesto_bulk_transition=True).action_delivered()
+
+    def unlink(self):
+        self._release_daily_folios()
+        return super().unlink()
 
     # =========================================================================
     # BITÁCORA DE TRÁNSITOS DIRECTOS
@@ -1194,6 +1568,206 @@ class ManifiestoAmbiental(models.Model):
             'res_id': self.transito_directo_id.id,
         }
 
+    # =========================================================================
+    # LOTES DEL FOLIO
+    # =========================================================================
+    # create: el lote se crea al agregar la línea (comportamiento histórico).
+    # confirm: se crea al confirmar el manifiesto.
+    # receive: se crea solo al recibir los residuos (action_recibir_residuos).
+    LOT_CREATION_MODES = ('create', 'confirm', 'receive')
+
+    @api.model
+    def _get_lot_creation_mode(self):
+        ICP = self.env['ir.config_parameter'].sudo()
+        mode = ICP.get_param('manifiesto_ambiental.lot_creation_mode', 'create')
+        return mode if mode in self.LOT_CREATION_MODES else 'create'
+
+    def _filter_lot_ready(self):
+        """Manifiestos cuyas líneas ya deben tener lote según el modo configurado."""
+        mode = self._get_lot_creation_mode()
+        if mode == 'create':
+            return self
+        if mode == 'confirm':
+            return self.filtered(lambda m: m.state in self.MANIFIESTO_OFFICIAL_SEQUENCE_STATES)
+        return self.filtered('recepcion_ids')
+
+    def _materialize_folio_lots(self):
+        """Crea/asigna los lotes del folio de todas las líneas de estos manifiestos."""
+        self.residuo_ids._assign_folio_lots()
+
+    @api.model
+    def _get_deferred_lot_report(self):
+        """
+        Cuenta los lotes de folio sin movimientos ni existencias que no habrían
+        hecho falta con la creación diferida de lotes:
+
+        - huerfanos: con nombre de folio y sin línea de residuo que los use
+          (restos de renumeraciones);
+        - borrador: usados solo por manifiestos en borrador;
+        - cancelados: usados solo por manifiestos cancelados;
+        - sin_recepcion: de manifiestos oficiales aún sin recepción (solo
+          sobran en el modo 'receive').
+        """
+        self.env.cr.execute(r"""
+            WITH folio_lots AS (
+                SELECT l.id
+                  FROM stock_lot l
+                 WHERE (
+                        l.name ~ '^\w{1,4}-\d{8}(-\d{1,6})?$'
+                        OR EXISTS (SELECT 1 FROM manifiesto_ambiental_residuo r WHERE r.lot_id = l.id)
+                       )
+                   AND NOT EXISTS (SELECT 1 FROM stock_move_line ml WHERE ml.lot_id = l.id)
+                   AND NOT EXISTS (SELECT 1 FROM stock_quant q WHERE q.lot_id = l.id)
+            ),
+            lot_usage AS (
+                SELECT fl.id,
+                       COUNT(r.id) AS lines,
+                       COALESCE(BOOL_OR(m.state IN %(official)s), false) AS official,
+                       COALESCE(BOOL_OR(m.state = 'draft'), false) AS draft,
+                       COALESCE(BOOL_OR(
+                           m.state IN %(official)s
+                           AND EXISTS (SELECT 1 FROM residuo_recepcion rr WHERE rr.manifiesto_id = m.id)
+                       ), false) AS received
+                  FROM folio_lots fl
+                  LEFT JOIN manifiesto_ambiental_residuo r ON r.lot_id = fl.id
+                  LEFT JOIN manifiesto_ambiental m ON m.id = r.manifiesto_id
+                 GROUP BY fl.id
+            )
+            SELECT COUNT(*) FILTER (WHERE lines = 0),
+                   COUNT(*) FILTER (WHERE lines > 0 AND NOT official AND draft),
+                   COUNT(*) FILTER (WHERE lines > 0 AND NOT official AND NOT draft),
+                   COUNT(*) FILTER (WHERE official AND NOT received)
+              FROM lot_usage
+        """, {'official': tuple(self.MANIFIESTO_OFFICIAL_SEQUENCE_STATES)})
+        huerfanos, borrador, cancelados, sin_recepcion = self.env.cr.fetchone()
+        return {
+            'huerfanos': huerfanos,
+            'borrador': borrador,
+            'cancelados': cancelados,
+            'sin_recepcion': sin_recepcion,
+        }
+
+    LOT_GC_MODES = ('dry_run', 'archive', 'delete')
+    LOT_GC_GRACE_HOURS = 24
+
+    @api.model
+    def _get_lot_gc_settings(self):
+        """(modo, tamaño de lote, lotes por corrida) de la limpieza de lotes de folio."""
+        ICP = self.env['ir.config_parameter'].sudo()
+        mode = ICP.get_param('manifiesto_ambiental.lot_gc_mode', 'dry_run')
+        return (
+            mode if mode in self.LOT_GC_MODES else 'dry_run',
+            int(ICP.get_param('manifiesto_ambiental.lot_gc_batch_size', 1000)),
+            int(ICP.get_param('manifiesto_ambiental.lot_gc_max_batches', 10)),
+        )
+
+    @api.model
+    def _get_orphan_folio_lot_query(self, only_active=False):
+        """
+        Lotes con nombre de folio automático, con antigüedad mayor al margen de
+        gracia, sin movimientos, sin existencias y sin línea de residuo que los
+        use.
+        """
+        query = r"""
+            SELECT l.id, l.name
+              FROM stock_lot l
+             WHERE l.id > %(after_id)s
+               AND l.name ~ '^\w{1,4}-\d{8}(-\d{1,6})?$'
+               AND l.create_date < (now() at time zone 'UTC') - make_interval(hours => %(grace)s)
+               AND NOT EXISTS (SELECT 1 FROM stock_move_line ml WHERE ml.lot_id = l.id)
+               AND NOT EXISTS (SELECT 1 FROM stock_quant q WHERE q.lot_id = l.id)
+               AND NOT EXISTS (SELECT 1 FROM manifiesto_ambiental_residuo r WHERE r.lot_id = l.id)
+        """
+        if only_active:
+            query += " AND l.active"
+        return query + " ORDER BY l.id LIMIT %(limit)s"
+
+    @api.model
+    def _gc_folio_lots(self, lots, mode):
+        if mode == 'archive':
+            lots.write({'active': False})
+        else:
+            lots.unlink()
+
+    @api.model
+    def _gc_orphan_folio_lots(self, mode=None):
+        """
+        Limpia por lotes los stock.lot de folio que quedaron sin uso
+        (renumeraciones, cancelaciones).
+
+        - dry_run: solo reporta cuántos hay y algunos nombres.
+        - archive: los archiva (si stock.lot tiene campo active).
+        - delete: los elimina.
+
+        Procesa a lo sumo `lot_gc_max_batches` lotes de `lot_gc_batch_size`
+        registros por corrida y continúa en la siguiente desde el último id
+        (manifiesto_ambiental.lot_gc_last_id).
+        """
+        settings_mode, batch_size, max_batches = self._get_lot_gc_settings()
+        mode = mode or settings_mode
+        Lot = self.env['stock.lot'].sudo()
+        ICP = self.env['ir.config_parameter'].sudo()
+        cr = self.env.cr
+
+        if mode == 'archive' and 'active' not in Lot._fields:
+            _logger.warning("stock.lot no tiene campo active; la limpieza de lotes se ejecuta en modo dry_run.")
+            mode = 'dry_run'
+
+        if mode == 'dry_run':
+            cr.execute(
+                "SELECT COUNT(*), (ARRAY_AGG(name ORDER BY id))[1:20] FROM (%s) orphan_lots"
+                % self._get_orphan_folio_lot_query(),
+                {'after_id': 0, 'grace': self.LOT_GC_GRACE_HOURS, 'limit': None},
+            )
+            total, sample = cr.fetchone()
+            _logger.info(
+                "Limpieza de lotes de folio (dry_run): %s lotes sin uso. Ejemplos: %s",
+                total, ', '.join(sample or []),
+            )
+            return {'mode': mode, 'candidates': total, 'processed': 0, 'sample': sample or []}
+
+        after_id = int(ICP.get_param('manifiesto_ambiental.lot_gc_last_id', 0))
+        query = self._get_orphan_folio_lot_query(only_active=(mode == 'archive'))
+        processed = failed = 0
+        finished = False
+
+        for _batch in range(max_batches):
+            cr.execute(query, {'after_id': after_id, 'grace': self.LOT_GC_GRACE_HOURS, 'limit': batch_size})
+            lot_ids = [row[0] for row in cr.fetchall()]
+            if not lot_ids:
+                finished = True
+                break
+
+            after_id = lot_ids[-1]
+            lots = Lot.browse(lot_ids)
+            try:
+                with cr.savepoint():
+                    self._gc_folio_lots(lots, mode)
+                processed += len(lot_ids)
+            except Exception:
+                # Un solo lote que no se puede limpiar (p. ej. referenciado
+                # por otro módulo) revierte todo el bloque; se reintenta uno
+                # por uno para no dejar atrás a los demás.
+                for lot in lots:
+                    try:
+                        with cr.savepoint():
+                            self._gc_folio_lots(lot, mode)
+                        processed += 1
+                    except Exception as e:
+                        failed += 1
+                        _logger.warning("No se pudo limpiar el lote de folio %s (id %s): %s", lot.name, lot.id, str(e))
+
+        ICP.set_param('manifiesto_ambiental.lot_gc_last_id', 0 if finished else after_id)
+        _logger.info(
+            "Limpieza de lotes de folio (%s): %s procesados, %s con error%s.",
+            mode, processed, failed, '' if finished else ', continúa en la siguiente corrida',
+        )
+        return {'mode': mode, 'candidates': processed + failed, 'processed': processed, 'sample': []}
+
+    @api.model
+    def _cron_gc_orphan_folio_lots(self):
+        return self._gc_orphan_folio_lots()
+
     # =========================================================================
     # INTEGRACIÓN CON RECEPCIÓN
     # =========================================================================
@@ -1204,6 +1778,10 @@ class ManifiestoAmbiental(models.Model):
         if not self.residuo_ids:
             raise UserError(_("No hay residuos en el manifiesto para recibir."))
 
+        # Con la creación diferida de lotes, aquí se materializan los lotes
+        # del folio que la recepción va a usar.
+        self._materialize_folio_lots()
+
         lineas_recepcion = []
         for residuo in self.residuo_ids:
             lineas_recepcion.append((0, 0, {
@@ -1572,6 +2150,9 @@ RESIDUOS
         exclude_fields = {
             'id', 'create_date', 'create_uid', 'write_date', 'write_uid',
             'version_history_ids', 'residuo_ids', '__last_update', 'display_name',
+            # El préstamo solo concilia el manifiesto original; la versión
+            # conserva folio y marca de manual por las reglas de abajo.
+            'folio_lease_id',
         }
         new_vals = {}
         for field_name, field in self._fields.items():
@@ -1604,8 +2185,10 @@ RESIDUOS
         return new_vals
 
     def _copy_residuos_to_version(self, new_version):
-        for residuo in self.residuo_ids:
-            self.env['manifiesto.ambiental.residuo'].create({
+        # Copia del sistema: una sola creación y sin mensajes de "Residuo
+        # agregado" en la nueva versión.
+        self.env['manifiesto.ambiental.residuo'].with_context(manifiesto_residuo_skip_log=True).create([
+            {
                 'manifiesto_id': new_version.id,
 
                 # Identificación
@@ -1634,7 +2217,12 @@ RESIDUOS
                 # Etiquetado
                 'etiqueta_si': residuo.etiqueta_si,
                 'etiqueta_no': residuo.etiqueta_no,
-            })
+
+                # Origen (sincronización con la orden de servicio)
+                'origin_line_id': residuo.origin_line_id,
+            }
+            for residuo in self.residuo_ids
+        ])
 
     def _deactivate_current_version(self):
         self.write({'is_current_version': False, 'state': 'delivered'})
@@ -1735,6 +2323,12 @@ class ManifiestoAmbientalResiduo(models.Model):
     etiqueta_si = fields.Boolean(string='Etiqueta - Sí', default=True)
     etiqueta_no = fields.Boolean(string='Etiqueta - No', default=False)
     lot_id = fields.Many2one('stock.lot', string='Número de Lote', readonly=True)
+    origin_line_id = fields.Integer(
+        string='Línea de Origen',
+        index='btree_not_null',
+        readonly=True,
+        help='Id de la línea de la orden de servicio de la que proviene el residuo.',
+    )
 
     @api.depends('clasificacion_corrosivo', 'clasificacion_reactivo', 'clasificacion_explosivo',
                  'clasificacion_toxico', 'clasificacion_inflamable', 'clasificacion_biologico')
@@ -1783,7 +2377,14 @@ class ManifiestoAmbientalResiduo(models.Model):
         if self.etiqueta_no:
             self.etiqueta_si = False
 
-    def _get_field_display_value(self, field_name, value):
+    def _get_selection_labels(self, field_name, selection_cache):
+        """Etiquetas {valor: etiqueta} de un campo selection, una vez por campo."""
+        if field_name not in selection_cache:
+            field = self._fields[field_name]
+            selection_cache[field_name] = dict(field._description_selection(self.env))
+        return selection_cache[field_name]
+
+    def _get_field_display_value(self, field_name, value, selection_cache=None):
         """Retorna el valor legible de un campo para mostrar en el chatter."""
         if value is False or value is None:
             return 'Vacío'
@@ -1793,9 +2394,12 @@ class ManifiestoAmbientalResiduo(models.Model):
         if field.type == 'boolean':
             return 'Sí' if value else 'No'
         if field.type == 'selection' and value:
-            sel_dict = dict(field.selection)
-            return sel_dict.get(value, value)
+            labels = self._get_selection_labels(field_name, {} if selection_cache is None else selection_cache)
+            return labels.get(value, value)
         if field.type == 'many2one':
+            if isinstance(value, tuple):
+                # Valor de read(): (id, display_name)
+                return value[1] or 'Vacío'
             if hasattr(value, 'display_name'):
                 return value.display_name or 'Vacío'
             return str(value) if value else 'Vacío'
@@ -1803,106 +2407,218 @@ class ManifiestoAmbientalResiduo(models.Model):
             return 'Vacío'
         return str(value)
 
+    RESIDUO_LOG_TITLES = {
+        'create': "📦 Residuos agregados",
+        'create_resync': "📦 Residuos agregados por resincronización con la orden de servicio",
+        'unlink': "🗑️ Residuos eliminados",
+        'unlink_resync': "🗑️ Residuos eliminados por resincronización con la orden de servicio",
+    }
+
+    @api.model
+    def _queue_residuo_log(self, kind, entries):
+        """
+        Acumula los eventos de líneas de residuo de la transacción, como
+        (manifiesto_id, texto), y al final encola un solo mensaje por
+        manifiesto y tipo de evento en manifiesto.ambiental.chatter.queue.
+        """
+        if not entries:
+            return
+
+        if self.env.context.get('manifiesto_residuo_resync'):
+            kind = '%s_resync' % kind
+
+        precommit = self.env.cr.precommit
+        pending = precommit.data.get('manifiesto.residuo.log')
+        if pending is None:
+            pending = precommit.data['manifiesto.residuo.log'] = defaultdict(list)
+            precommit.add(self._flush_residuo_log)
+
+        for manifiesto_id, text in entries:
+            pending[(manifiesto_id, kind)].append(text)
+
+    @api.model
+    def _flush_residuo_log(self):
+        pending = self.env.cr.precommit.data.pop('manifiesto.residuo.log', {})
+        if not pending:
+            return
+
+        existing_ids = set(self.env['manifiesto.ambiental'].browse(
+            {manifiesto_id for manifiesto_id, _kind in pending}
+        ).exists().ids)
+
+        self.env['manifiesto.ambiental.chatter.queue']._enqueue([
+            (
+                manifiesto_id,
+                "%s (%s):\n%s" % (
+                    self.RESIDUO_LOG_TITLES[kind],
+                    len(texts),
+                    "\n".join("  • %s" % text for text in texts),
+                ),
+            )
+            for (manifiesto_id, kind), texts in pending.items()
+            if manifiesto_id in existing_ids
+        ])
+        # Los callbacks de precommit corren después del flush de la
+        # transacción: sin este flush las filas creadas aquí no llegan a la
+        # base (igual que mail.thread._track_finalize).
+        self.env.flush_all()
+
     def write(self, vals):
-        changes_by_manifiesto = {}
+        lines_by_manifiesto = defaultdict(list)
         tracked_keys = [k for k in vals if k in self.TRACKED_FIELDS]
 
         if tracked_keys:
-            for rec in self:
+            selection_cache = {}
+
+            # El valor nuevo es el mismo para todas las líneas: su texto se
+            # resuelve una sola vez por campo.
+            new_displays = {}
+            for field_key in tracked_keys:
+                field = self._fields[field_key]
+                new_val = vals[field_key]
+                if field.type == 'many2one' and new_val:
+                    new_displays[field_key] = self.env[field.comodel_name].browse(new_val).display_name or 'Vacío'
+                else:
+                    new_displays[field_key] = self._get_field_display_value(field_key, new_val, selection_cache)
+
+            # Valores anteriores de todo el recordset con un solo read();
+            # los many2one vienen como (id, display_name).
+            snapshot = self.read(tracked_keys + ['nombre_residuo'])
+            for rec, old_values in zip(self, snapshot):
                 if not rec.manifiesto_id:
                     continue
-                mid = rec.manifiesto_id.id
-                if mid not in changes_by_manifiesto:
-                    changes_by_manifiesto[mid] = {'manifiesto': rec.manifiesto_id, 'lines': []}
 
                 line_changes = []
-                residuo_label = rec.nombre_residuo or f'Residuo #{rec.id}'
                 for field_key in tracked_keys:
-                    old_val = getattr(rec, field_key)
+                    old_val = old_values[field_key]
                     new_val = vals[field_key]
 
                     if self._fields[field_key].type == 'many2one':
-                        old_comparable = old_val.id if old_val else False
-                        new_comparable = new_val
+                        old_comparable = old_val[0] if old_val else False
+                        new_comparable = new_val or False
                     else:
                         old_comparable = old_val
                         new_comparable = new_val
 
                     if old_comparable != new_comparable:
                         label = self.TRACKED_FIELDS[field_key]
-                        old_display = self._get_field_display_value(field_key, old_val)
-                        if self._fields[field_key].type == 'many2one' and new_val:
-                            new_record = self.env[self._fields[field_key].comodel_name].browse(new_val)
-                            new_display = new_record.display_name or 'Vacío'
-                        else:
-                            new_display = self._get_field_display_value(field_key, new_val)
-                        line_changes.append(f"  • {label}: {old_display} → {new_display}")
+                        old_display = self._get_field_display_value(field_key, old_val, selection_cache)
+                        line_changes.append(f"  • {label}: {old_display} → {new_displays[field_key]}")
 
                 if line_changes:
-                    changes_by_manifiesto[mid]['lines'].append(
+                    residuo_label = old_values['nombre_residuo'] or f'Residuo #{rec.id}'
+                    lines_by_manifiesto[rec.manifiesto_id.id].append(
                         f"📦 {residuo_label}\n" + "\n".join(line_changes)
                     )
 
         res = super().write(vals)
 
-        for _mid, data in changes_by_manifiesto.items():
-            if data['lines']:
-                body_text = "Cambios en Residuos:\n\n" + "\n\n".join(data['lines'])
-                data['manifiesto'].message_post(
-                    body=body_text,
-                    message_type='notification',
-                    subtype_xmlid='mail.mt_note',
-                )
+        # La publicación en el chatter ocurre después del commit.
+        self.env['manifiesto.ambiental.chatter.queue']._enqueue([
+            (manifiesto_id, "Cambios en Residuos:\n\n" + "\n\n".join(lines))
+            for manifiesto_id, lines in lines_by_manifiesto.items()
+        ])
 
         return res
 
     @api.model_create_multi
     def create(self, vals_list):
         records = super().create(vals_list)
-        records._create_lot_for_residuo()
-
-        for rec in records:
-            if rec.manifiesto_id:
-                nombre = rec.nombre_residuo or (rec.product_id.name if rec.product_id else 'Sin nombre')
-                cretib = rec.clasificaciones_display or 'Ninguna'
-                body = f"📦 Residuo agregado: {nombre} — {rec.cantidad} kg — CRETIB: {cretib}"
-                rec.manifiesto_id.message_post(
-                    body=body,
-                    message_type='notification',
-                    subtype_xmlid='mail.mt_note',
+        lot_ready = records.manifiesto_id._filter_lot_ready()
+        records.filtered(lambda r: r.manifiesto_id in lot_ready)._create_lot_for_residuo()
+
+        if not self.env.context.get('manifiesto_residuo_skip_log'):
+            records._queue_residuo_log('create', [
+                (
+                    rec.manifiesto_id.id,
+                    "{nombre} — {cantidad} kg — CRETIB: {cretib}".format(
+                        nombre=rec.nombre_residuo or (rec.product_id.name if rec.product_id else 'Sin nombre'),
+                        cantidad=rec.cantidad,
+                        cretib=rec.clasificaciones_display or 'Ninguna',
+                    ),
                 )
+                for rec in records
+                if rec.manifiesto_id
+            ])
 
         return records
 
     def unlink(self):
-        for rec in self:
-            if rec.manifiesto_id:
-                nombre = rec.nombre_residuo or f'Residuo #{rec.id}'
-                body = f"🗑️ Residuo eliminado: {nombre} — {rec.cantidad} kg"
-                rec.manifiesto_id.message_post(
-                    body=body,
-                    message_type='notification',
-                    subtype_xmlid='mail.mt_note',
-                )
-        return super().unlink()
+        entries = []
+        if not self.env.context.get('manifiesto_residuo_skip_log'):
+            entries = [
+                (rec.manifiesto_id.id, f"{rec.nombre_residuo or f'Residuo #{rec.id}'} — {rec.cantidad} kg")
+                for rec in self
+                if rec.manifiesto_id
+            ]
+
+        res = super().unlink()
+
+        # Se registra después del borrado: si el DELETE falla no queda un
+        # mensaje de algo que no ocurrió.
+        self._queue_residuo_log('unlink', entries)
+        return res
+
+    @api.model
+    def _get_or_create_folio_lots(self, keys):
+        """
+        Devuelve {(nombre, product_id, company_id): lot_id} para las llaves dadas.
+
+        Los lotes existentes se leen con una sola búsqueda y los que faltan se
+        crean en un solo create().
+        """
+        keys = {key for key in keys if key[0] and key[1]}
+        if not keys:
+            return {}
+
+        Lot = self.env['stock.lot']
+        lots_by_key = {}
+        existing = Lot.search_fetch([
+            ('name', 'in', list({key[0] for key in keys})),
+            ('product_id', 'in', list({key[1] for key in keys})),
+            ('company_id', 'in', list({key[2] for key in keys})),
+        ], ['name', 'product_id', 'company_id'], order='id')
+        for lot in existing:
+            key = (lot.name, lot.product_id.id, lot.company_id.id)
+            if key in keys:
+                lots_by_key.setdefault(key, lot.id)
+
+        missing = sorted(keys - lots_by_key.keys())
+        if missing:
+            new_lots = Lot.create([
+                {'name': name, 'product_id': product_id, 'company_id': company_id}
+                for name, product_id, company_id in missing
+            ])
+            lots_by_key.update(zip(missing, new_lots.ids))
+
+        return lots_by_key
+
+    def _assign_folio_lots(self):
+        """
+        Asigna a cada línea el lote con el folio de su manifiesto.
+
+        Resuelve los lotes de todo el recordset en bloque y escribe lot_id una
+        vez por lote.
+        """
+        def lot_key(residuo):
+            manifiesto = residuo.manifiesto_id
+            return (manifiesto.numero_manifiesto, residuo.product_id.id, manifiesto.company_id.id)
+
+        residuos = self.filtered(lambda r: r.product_id and r.manifiesto_id.numero_manifiesto)
+        lots_by_key = self._get_or_create_folio_lots(lot_key(residuo) for residuo in residuos)
+
+        residuo_ids_by_lot = defaultdict(list)
+        for residuo in residuos:
+            lot_id = lots_by_key[lot_key(residuo)]
+            if residuo.lot_id.id != lot_id:
+                residuo_ids_by_lot[lot_id].append(residuo.id)
+
+        for lot_id, residuo_ids in residuo_ids_by_lot.items():
+            self.browse(residuo_ids).write({'lot_id': lot_id})
 
     def _create_lot_for_residuo(self):
-        for record in self:
-            if record.product_id and record.manifiesto_id.numero_manifiesto:
-                existing_lot = self.env['stock.lot'].search([
-                    ('name', '=', record.manifiesto_id.numero_manifiesto),
-                    ('product_id', '=', record.product_id.id),
-                    ('company_id', '=', record.manifiesto_id.company_id.id),
-                ], limit=1)
-                if not existing_lot:
-                    lot = self.env['stock.lot'].create({
-                        'name': record.manifiesto_id.numero_manifiesto,
-                        'product_id': record.product_id.id,
-                        'company_id': record.manifiesto_id.company_id.id,
-                    })
-                    record.lot_id = lot.id
-                else:
-                    record.lot_id = existing_lot.id
+        """Lote con el folio del manifiesto para las líneas con producto, resuelto en bloque."""
+        self._assign_folio_lots()
 
 
 # =============================================================================
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, SUPERUSER_ID
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+class ManifiestoAmbientalChatterQueue(models.Model):
+    """
+    Mensajes de bitácora del manifiesto pendientes de publicar.
+
+    Las operaciones sobre líneas de residuo solo encolan el texto dentro de
+    la transacción del usuario; la publicación en el chatter (mail.message,
+    notificaciones, seguidores) ocurre después del commit, en un cursor
+    propio, o en la siguiente corrida del cron si ese paso falla.
+    """
+    _name = 'manifiesto.ambiental.chatter.queue'
+    _description = 'Cola de Mensajes del Manifiesto'
+    _order = 'id'
+
+    manifiesto_id = fields.Many2one('manifiesto.ambiental', string='Manifiesto', required=True, ondelete='cascade', index=True)
+    body = fields.Text(string='Mensaje', required=True)
+    author_id = fields.Many2one('res.partner', string='Autor', ondelete='set null')
+
+    POSTCOMMIT_KEY = 'manifiesto.ambiental.chatter.queue'
+
+    @api.model
+    def _enqueue(self, entries):
+        """Encola [(manifiesto_id, texto)] y agenda su publicación al terminar la transacción."""
+        if not entries:
+            return self.browse()
+
+        author_id = self.env.user.partner_id.id
+        queued = self.sudo().create([
+            {'manifiesto_id': manifiesto_id, 'body': body, 'author_id': author_id}
+            for manifiesto_id, body in entries
+        ])
+
+        postcommit = self.env.cr.postcommit
+        pending = postcommit.data.get(self.POSTCOMMIT_KEY)
+        if pending is None:
+            pending = postcommit.data[self.POSTCOMMIT_KEY] = []
+            postcommit.add(self._post_after_commit)
+        pending.extend(queued.ids)
+        return queued
+
+    @api.model
+    def _post_after_commit(self):
+        queue_ids = self.env.cr.postcommit.data.pop(self.POSTCOMMIT_KEY, [])
+        if not queue_ids:
+            return
+
+        try:
+            with self.env.registry.cursor() as cr:
+                env = api.Environment(cr, SUPERUSER_ID, {})
+                env[self._name]._post_pending(queue_ids=queue_ids)
+        except Exception as e:
+            # Quedan en la cola; el cron los publica en su siguiente corrida.
+            _logger.warning("No se pudieron publicar los mensajes encolados del manifiesto: %s", str(e))
+
+    @api.model
+    def _post_pending(self, queue_ids=None, limit=500):
+        """
+        Publica los mensajes encolados (los indicados o los más antiguos) y
+        los elimina de la cola. Las filas tomadas por otro proceso se saltan,
+        así el hook y el cron nunca publican el mismo mensaje dos veces.
+        """
+        query = "SELECT id FROM manifiesto_ambiental_chatter_queue"
+        params = []
+        if queue_ids is not None:
+            query += " WHERE id IN %s"
+            params.append(tuple(queue_ids))
+        query += " ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED"
+        params.append(limit)
+
+        self.env.cr.execute(query, params)
+        queued = self.sudo().browse([row[0] for row in self.env.cr.fetchall()])
+        if not queued:
+            return 0
+
+        for entry in queued:
+            entry.manifiesto_id.message_post(
+                body=entry.body,
+                author_id=entry.author_id.id or None,
+                message_type='notification',
+                subtype_xmlid='mail.mt_note',
+            )
+
+        count = len(queued)
+        queued.unlink()
+        return count
+
+    @api.model
+    def _cron_post_pending(self, batch_size=500):
+        total = 0
+        while True:
+            posted = self._post_pending(limit=batch_size)
+            total += posted
+            if posted < batch_size:
+                break
+        if total:
+            _logger.info("Mensajes de manifiesto publicados desde la cola: %s.", total)
+        return total
@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+from psycopg2.errors import LockNotAvailable
+import logging
+import time
+
+_logger = logging.getLogger(__name__)
+
+
+class ManifiestoAmbientalFolioCounter(models.Model):
+    """
+    Contador de folios diarios por compañía + generador + fecha.
+
+    Los consecutivos en uso para una llave son 1..last_sequence menos los
+    que estén en gap_sequences (liberados por cancelación, borrado o
+    renumeración). Así tomar o liberar un folio no depende del historial de
+    manifiestos del generador.
+
+    La fila se bloquea con SELECT ... FOR UPDATE y el bloqueo dura hasta el
+    fin de la transacción. Al ser una fila por llave exacta, dos llaves
+    distintas nunca se bloquean entre sí (a diferencia de un advisory lock
+    sobre hashtext, que puede colisionar).
+    """
+    _name = 'manifiesto.ambiental.folio.counter'
+    _description = 'Contador de Folios Diarios del Manifiesto'
+    _order = 'fecha desc, id desc'
+    _rec_name = 'generador_id'
+
+    company_id = fields.Many2one('res.company', string='Compañía', required=True, ondelete='cascade')
+    generador_id = fields.Many2one('res.partner', string='Generador', required=True, ondelete='cascade')
+    fecha = fields.Date(string='Fecha', required=True)
+    last_sequence = fields.Integer(string='Último Consecutivo', default=0)
+    gap_sequences = fields.Char(
+        string='Consecutivos Libres',
+        help='Consecutivos liberados por debajo del último emitido, separados por coma.',
+    )
+    lock_contention_count = fields.Integer(
+        string='Esperas por Bloqueo',
+        default=0,
+        readonly=True,
+        help='Veces que una transacción tuvo que esperar a otra para tomar este contador.',
+    )
+
+    _company_generador_fecha_uniq = models.Constraint(
+        'UNIQUE(company_id, generador_id, fecha)',
+        'Ya existe un contador de folios para este generador, fecha y compañía.',
+    )
+
+    # =========================================================================
+    # BLOQUEO / OBTENCIÓN
+    # =========================================================================
+    _COUNTER_INSERT_QUERY = """
+        INSERT INTO manifiesto_ambiental_folio_counter
+            (company_id, generador_id, fecha, last_sequence,
+             create_uid, create_date, write_uid, write_date)
+        VALUES (%s, %s, %s, 0, %s, now() at time zone 'UTC', %s, now() at time zone 'UTC')
+        ON CONFLICT (company_id, generador_id, fecha) DO NOTHING
+        RETURNING id
+    """
+
+    _COUNTER_SELECT_QUERY = """
+        SELECT id FROM manifiesto_ambiental_folio_counter
+         WHERE company_id = %s AND generador_id = %s AND fecha = %s
+           FOR UPDATE
+    """
+
+    @api.model
+    def _get_locked(self, company_id, generador_partner, fecha):
+        """
+        Devuelve el contador de la llave bloqueado para la transacción.
+
+        Si la fila no existía se crea y se inicializa desde los folios ya
+        registrados, de modo que instalar el contador sobre datos previos no
+        reinicia la numeración.
+        """
+        params = [company_id, generador_partner.id, fecha]
+
+        # Primero sin espera, para poder contar cuándo hubo contención.
+        contended = False
+        try:
+            counter_id, inserted = self._try_lock(params)
+        except LockNotAvailable:
+            contended = True
+            counter_id, inserted = self._lock_with_timeout(params, company_id, generador_partner, fecha)
+
+        counter = self.sudo().browse(counter_id)
+        counter.invalidate_recordset()
+
+        if contended:
+            _logger.debug(
+                "Contención en contador de folios %s (compañía %s, generador %s, fecha %s).",
+                counter.id, company_id, generador_partner.id, fecha,
+            )
+            counter.write({'lock_contention_count': counter.lock_contention_count + 1})
+
+        if inserted:
+            counter._seed_from_manifiestos()
+
+        return counter
+
+    @api.model
+    def _try_lock(self, params, timeout_ms=None):
+        """
+        Un intento de crear (si falta) y bloquear la fila de la llave.
+        Devuelve (id, creada) o levanta LockNotAvailable.
+
+        El INSERT también espera cuando otra transacción creó la misma llave y
+        aún no confirma (primer folio del día de un generador), así que corre
+        bajo el mismo lock_timeout que el SELECT ... FOR UPDATE. Sin
+        `timeout_ms` el intento no espera: NOWAIT si la fila ya existe y un
+        lock_timeout mínimo para crearla.
+        """
+        cr = self.env.cr
+        with cr.savepoint(flush=False):
+            if not timeout_ms:
+                cr.execute(self._COUNTER_SELECT_QUERY + " NOWAIT", params, log_exceptions=False)
+                row = cr.fetchone()
+                if row:
+                    return row[0], False
+
+            cr.execute("SHOW lock_timeout")
+            previous_timeout = cr.fetchone()[0]
+            cr.execute("SELECT set_config('lock_timeout', %s, true)", ['%sms' % (timeout_ms or 1)])
+            cr.execute(
+                self._COUNTER_INSERT_QUERY,
+                params + [self.env.uid, self.env.uid],
+                log_exceptions=False,
+            )
+            inserted = bool(cr.fetchone())
+            cr.execute(self._COUNTER_SELECT_QUERY, params, log_exceptions=False)
+            counter_id = cr.fetchone()[0]
+            cr.execute("SELECT set_config('lock_timeout', %s, true)", [previous_timeout])
+        return counter_id, inserted
+
+    @api.model
+    def _get_lock_settings(self):
+        """Parámetros de espera del bloqueo: (lock_timeout en ms, reintentos, espera base en s)."""
+        ICP = self.env['ir.config_parameter'].sudo()
+        return (
+            int(ICP.get_param('manifiesto_ambiental.numbering_lock_timeout_ms', 5000)),
+            int(ICP.get_param('manifiesto_ambiental.numbering_lock_retries', 2)),
+            float(ICP.get_param('manifiesto_ambiental.numbering_lock_backoff', 0.2)),
+        )
+
+    @api.model
+    def _lock_with_timeout(self, params, company_id, generador_partner, fecha):
+        """
+        Espera la creación y el bloqueo de la fila con lock_timeout y
+        reintentos con espera exponencial. Si no se obtiene, levanta UserError
+        en lugar de dejar la operación colgada detrás de otra transacción larga.
+
+        Cada espera se registra en `manifiesto.ambiental.lock.wait`.
+        """
+        timeout_ms, retries, backoff = self._get_lock_settings()
+
+        start = time.monotonic()
+        attempts = 0
+        while True:
+            attempts += 1
+            try:
+                counter_id, inserted = self._try_lock(params, timeout_ms=timeout_ms)
+                break
+            except LockNotAvailable:
+                if attempts > retries:
+                    wait_ms = (time.monotonic() - start) * 1000.0
+                    self.env['manifiesto.ambiental.lock.wait']._log_wait(
+                        company_id, generador_partner.id, fecha, wait_ms, attempts, timed_out=True,
+                    )
+                    raise UserError(_(
+                        "La numeración de folios de %(generador)s para el %(fecha)s está ocupada por "
+                        "otra operación en curso. Intente de nuevo en unos momentos.",
+                        generador=generador_partner.display_name,
+                        fecha=fields.Date.to_string(fecha),
+                    ))
+                time.sleep(backoff * (2 ** (attempts - 1)))
+
+        wait_ms = (time.monotonic() - start) * 1000.0
+        self.env['manifiesto.ambiental.lock.wait']._log_wait(
+            company_id, generador_partner.id, fecha, wait_ms, attempts,
+        )
+        return counter_id, inserted
+
+    # =========================================================================
+    # ESTADO DEL CONTADOR
+    # =========================================================================
+    def _get_gaps(self):
+        self.ensure_one()
+        return {
+            int(seq)
+            for seq in (self.gap_sequences or '').split(',')
+            if seq.strip().isdigit()
+        }
+
+    def _store(self, last_sequence, gaps):
+        """Persiste el contador recortando huecos al final del rango."""
+        self.ensure_one()
+        gaps = {seq for seq in gaps if 0 < seq <= last_sequence}
+        while last_sequence and last_sequence in gaps:
+            gaps.discard(last_sequence)
+            last_sequence -= 1
+
+        self.write({
+            'last_sequence': last_sequence,
+            'gap_sequences': ','.join(str(seq) for seq in sorted(gaps)) or False,
+        })
+
+    def _set_used_sequences(self, used):
+        self.ensure_one()
+        used = {seq for seq in used if seq and seq > 0}
+        last_sequence = max(used) if used else 0
+        self._store(last_sequence, set(range(1, last_sequence + 1)) - used)
+
+    def _is_used(self, sequence):
+        self.ensure_one()
+        return 0 < sequence <= self.last_sequence and sequence not in self._get_gaps()
+
+    def _take_sequence(self):
+        """Toma el menor consecutivo libre."""
+        self.ensure_one()
+        gaps = self._get_gaps()
+        last_sequence = self.last_sequence
+
+        if gaps:
+            sequence = min(gaps)
+            gaps.discard(sequence)
+        else:
+            sequence = last_sequence = last_sequence + 1
+
+        self._store(last_sequence, gaps)
+        return sequence
+
+    def _take_sequences(self, count):
+        """Toma `count` consecutivos (huecos primero) con una sola escritura."""
+        self.ensure_one()
+        gaps = sorted(self._get_gaps())
+        last_sequence = self.last_sequence
+
+        sequences = gaps[:count]
+        remaining = count - len(sequences)
+        sequences += list(range(last_sequence + 1, last_sequence + 1 + remaining))
+        last_sequence += remaining
+
+        self._store(last_sequence, set(gaps[count:]))
+        return sequences
+
+    def _claim_sequence(self, sequence):
+        """Marca como usado un consecutivo concreto (folio capturado)."""
+        self.ensure_one()
+        if not sequence or sequence < 1:
+            return
+
+        gaps = self._get_gaps()
+        last_sequence = self.last_sequence
+
+        if sequence > last_sequence:
+            gaps.update(range(last_sequence + 1, sequence))
+            last_sequence = sequence
+        else:
+            gaps.discard(sequence)
+
+        self._store(last_sequence, gaps)
+
+    def _release_sequence(self, sequence):
+        """Devuelve un consecutivo para que el siguiente folio lo reutilice."""
+        self.ensure_one()
+        if not sequence or sequence < 1 or sequence > self.last_sequence:
+            return
+
+        gaps = self._get_gaps()
+        gaps.add(sequence)
+        self._store(self.last_sequence, gaps)
+
+    def _compact_sequence(self, sequence):
+        """
+        Si hay un consecutivo libre menor que `sequence`, lo toma y libera
+        `sequence`. Devuelve el consecutivo resultante.
+        """
+        self.ensure_one()
+        lower_gaps = [seq for seq in self._get_gaps() if seq < sequence]
+        if not lower_gaps:
+            return sequence
+
+        new_sequence = min(lower_gaps)
+        self._claim_sequence(new_sequence)
+        self._release_sequence(sequence)
+        return new_sequence
+
+    # =========================================================================
+    # INICIALIZACIÓN DESDE FOLIOS EXISTENTES
+    # =========================================================================
+    def _seed_from_manifiestos(self):
+        Manifiesto = self.env['manifiesto.ambiental']
+        for counter in self:
+            used = Manifiesto._get_used_daily_sequences(
+                generador_partner=counter.generador_id,
+                fecha_servicio=counter.fecha,
+                company_id=counter.company_id.id,
+                states=Manifiesto.MANIFIESTO_ACTIVE_SEQUENCE_STATES,
+            )
+            counter._set_used_sequences(used)
+
+    @api.model
+    def _backfill_from_manifiestos(self):
+        """Crea los contadores de todas las llaves con folios activos."""
+        Manifiesto = self.env['manifiesto.ambiental']
+        self.env.cr.execute(
+            """
+            SELECT DISTINCT company_id, generador_id, generador_fecha
+              FROM manifiesto_ambiental
+             WHERE company_id IS NOT NULL
+               AND generador_id IS NOT NULL
+               AND generador_fecha IS NOT NULL
+               AND state IN %s
+             ORDER BY company_id, generador_id, generador_fecha
+            """,
+            [tuple(Manifiesto.MANIFIESTO_ACTIVE_SEQUENCE_STATES)],
+        )
+        keys = self.env.cr.fetchall()
+
+        Partner = self.env['res.partner']
+        for company_id, generador_id, fecha in keys:
+            self._get_locked(company_id, Partner.browse(generador_id), fecha)
+
+        _logger.info("Contadores de folio inicializados: %s llaves.", len(keys))
+        return len(keys)
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+from datetime import timedelta
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+class ManifiestoAmbientalFolioLease(models.Model):
+    """
+    Bloque de folios diarios prestado a un dispositivo o usuario.
+
+    Sirve para la captura sin conexión en sitio del generador: el bloque se
+    toma del contador de una sola vez (un bloqueo por bloque), y los
+    manifiestos que llegan después con `folio_lease_id` conservan su folio sin
+    volver a bloquear el contador. Los consecutivos que no se usen antes de
+    `expires_at` se devuelven al contador por cron.
+    """
+    _name = 'manifiesto.ambiental.folio.lease'
+    _description = 'Préstamo de Folios del Manifiesto'
+    _order = 'create_date desc, id desc'
+    _rec_name = 'generador_id'
+
+    company_id = fields.Many2one('res.company', string='Compañía', required=True, readonly=True, ondelete='cascade')
+    generador_id = fields.Many2one('res.partner', string='Generador', required=True, readonly=True, ondelete='cascade', index=True)
+    fecha = fields.Date(string='Fecha del Folio', required=True, readonly=True)
+    user_id = fields.Many2one('res.users', string='Usuario', readonly=True, default=lambda self: self.env.user)
+    device_id = fields.Char(string='Dispositivo', readonly=True)
+    sequences = fields.Char(string='Consecutivos Prestados', readonly=True)
+    used_sequences = fields.Char(string='Consecutivos Usados', readonly=True)
+    expires_at = fields.Datetime(string='Vence', readonly=True, index=True)
+    state = fields.Selection([
+        ('active', 'Activo'),
+        ('done', 'Usado'),
+        ('returned', 'Devuelto'),
+    ], string='Estado', default='active', required=True, readonly=True, index=True)
+    manifiesto_ids = fields.One2many('manifiesto.ambiental', 'folio_lease_id', string='Manifiestos', readonly=True)
+
+    # =========================================================================
+    # API DE PRÉSTAMO
+    # =========================================================================
+    @api.model
+    def _get_lease_hours(self):
+        ICP = self.env['ir.config_parameter'].sudo()
+        return float(ICP.get_param('manifiesto_ambiental.folio_lease_hours', 24))
+
+    @api.model
+    def _get_lease_max_count(self):
+        ICP = self.env['ir.config_parameter'].sudo()
+        return int(ICP.get_param('manifiesto_ambiental.folio_lease_max_count', 50))
+
+    @api.model
+    def lease_folios(self, generador_id, fecha=None, count=10, device_id=False, company_id=None):
+        """
+        Presta `count` folios del día para el generador y devuelve
+        {'lease_id', 'folios', 'expires_at'}.
+
+        El contador se bloquea una sola vez para todo el bloque.
+        """
+        if count < 1:
+            raise UserError(_("Indique cuántos folios se deben prestar."))
+
+        max_count = self._get_lease_max_count()
+        if count > max_count:
+            raise UserError(_(
+                "No se pueden prestar más de %(max)s folios en un solo bloque.",
+                max=max_count,
+            ))
+
+        Manifiesto = self.env['manifiesto.ambiental']
+        generador = self.env['res.partner'].browse(generador_id).exists()
+        if not generador:
+            raise UserError(_("Debe indicar un generador para prestar folios."))
+
+        company_id = company_id or self.env.company.id
+        fecha = Manifiesto._normalize_manifiesto_date(fecha)
+        key = (company_id, generador.id, fecha)
+
+        counter = Manifiesto._lock_daily_numbering_keys([key])[key]
+        sequences = counter._take_sequences(count)
+
+        lease = self.sudo().create({
+            'company_id': company_id,
+            'generador_id': generador.id,
+            'fecha': fecha,
+            'user_id': self.env.uid,
+            'device_id': device_id,
+            'sequences': self._join_sequences(sequences),
+            'expires_at': fields.Datetime.now() + timedelta(hours=self._get_lease_hours()),
+        })
+        return {
+            'lease_id': lease.id,
+            'folios': lease._get_folio_numbers(),
+            'expires_at': fields.Datetime.to_string(lease.expires_at),
+        }
+
+    # =========================================================================
+    # CONSECUTIVOS
+    # =========================================================================
+    @api.model
+    def _split_sequences(self, value):
+        return {int(seq) for seq in (value or '').split(',') if seq.strip().isdigit()}
+
+    @api.model
+    def _join_sequences(self, sequences):
+        return ','.join(str(seq) for seq in sorted(sequences)) or False
+
+    def _get_numero_base(self):
+        self.ensure_one()
+        return self.env['manifiesto.ambiental']._get_manifiesto_number_base(self.generador_id, self.fecha)
+
+    def _get_folio_numbers(self):
+        self.ensure_one()
+        Manifiesto = self.env['manifiesto.ambiental']
+        numero_base = self._get_numero_base()
+        return [
+            Manifiesto._format_manifiesto_number(numero_base, seq)
+            for seq in sorted(self._split_sequences(self.sequences))
+        ]
+
+    def _holds_folio(self, manifiesto):
+        """True si el folio del manifiesto es uno de los prestados en este bloque."""
+        self.ensure_one()
+        return (
+            manifiesto.company_id == self.company_id
+            and manifiesto.generador_id == self.generador_id
+            and manifiesto.folio_base == self._get_numero_base()
+            and manifiesto.folio_seq in self._split_sequences(self.sequences)
+        )
+
+    def _reconcile_manifiestos(self, manifiestos):
+        """
+        Marca como usados los folios de `manifiestos` que vienen de este bloque.
+
+        Devuelve los manifiestos que no se pueden conciliar (bloque ya devuelto
+        o folio ajeno al bloque); esos se tratan como folios capturados.
+        """
+        self.ensure_one()
+        if self.state == 'returned':
+            return manifiestos
+
+        held = manifiestos.filtered(self._holds_folio)
+        if held:
+            used = self._split_sequences(self.used_sequences) | set(held.mapped('folio_seq'))
+            vals = {'used_sequences': self._join_sequences(used)}
+            if used >= self._split_sequences(self.sequences):
+                vals['state'] = 'done'
+            self.sudo().write(vals)
+
+        return manifiestos - held
+
+    # =========================================================================
+    # DEVOLUCIÓN
+    # =========================================================================
+    def action_return_unused(self):
+        """Devuelve al contador los consecutivos prestados que no se usaron."""
+        leases = self.filtered(lambda l: l.state == 'active')
+        if not leases:
+            return True
+
+        Manifiesto = self.env['manifiesto.ambiental']
+        counters = Manifiesto._lock_daily_numbering_keys(
+            (lease.company_id.id, lease.generador_id.id, lease.fecha) for lease in leases
+        )
+        for lease in leases:
+            counter = counters[(lease.company_id.id, lease.generador_id.id, lease.fecha)]
+            unused = lease._split_sequences(lease.sequences) - lease._split_sequences(lease.used_sequences)
+            if not unused:
+                continue
+
+            # Un folio del bloque que ya ocupa algún manifiesto activo (p. ej.
+            # sincronizado sin el préstamo) no se devuelve.
+            unused -= set(Manifiesto.search_fetch([
+                ('company_id', '=', lease.company_id.id),
+                ('generador_id', '=', lease.generador_id.id),
+                ('folio_base', '=', lease._get_numero_base()),
+                ('folio_seq', 'in', list(unused)),
+                ('state', 'in', list(Manifiesto.MANIFIESTO_ACTIVE_SEQUENCE_STATES)),
+            ], ['folio_seq']).mapped('folio_seq'))
+            for seq in sorted(unused):
+                counter._release_sequence(seq)
+
+        leases.sudo().write({'state': 'returned'})
+        return True
+
+    @api.model
+    def _cron_return_expired_leases(self, batch_size=200):
+        expired = self.sudo().search([
+            ('state', '=', 'active'),
+            ('expires_at', '<', fields.Datetime.now()),
+        ], limit=batch_size)
+        expired.action_return_unused()
+        if expired:
+            _logger.info("Préstamos de folios vencidos devueltos: %s.", len(expired))
+        return len(expired)
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, SUPERUSER_ID
+from datetime import timedelta
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+class ManifiestoAmbientalLockWait(models.Model):
+    """
+    Bitácora de esperas por el bloqueo de numeración de folios.
+
+    Se registra una línea cada vez que una transacción tuvo que esperar el
+    contador de un generador/fecha, con la duración y si terminó por
+    lock_timeout. Sirve para ver qué generadores y días causan contención.
+    """
+    _name = 'manifiesto.ambiental.lock.wait'
+    _description = 'Espera de Bloqueo de Numeración de Manifiestos'
+    _order = 'create_date desc, id desc'
+    _rec_name = 'generador_id'
+
+    company_id = fields.Many2one('res.company', string='Compañía', readonly=True, ondelete='cascade')
+    generador_id = fields.Many2one('res.partner', string='Generador', readonly=True, ondelete='cascade', index=True)
+    fecha = fields.Date(string='Fecha del Folio', readonly=True)
+    wait_ms = fields.Float(string='Espera (ms)', readonly=True, aggregator='avg')
+    attempts = fields.Integer(string='Intentos', readonly=True, aggregator='max')
+    timed_out = fields.Boolean(string='Sin Bloqueo (Timeout)', readonly=True)
+    user_id = fields.Many2one('res.users', string='Usuario', readonly=True, ondelete='set null')
+
+    WAIT_RETENTION_DAYS = 90
+
+    @api.model
+    def _log_wait(self, company_id, generador_id, fecha, wait_ms, attempts, timed_out=False):
+        """
+        Registra la espera en un cursor independiente: así queda guardada aunque
+        la transacción que esperaba termine en error (p. ej. por timeout).
+        """
+        try:
+            with self.env.registry.cursor() as cr:
+                env = api.Environment(cr, SUPERUSER_ID, {})
+                env[self._name].create({
+                    'company_id': company_id,
+                    'generador_id': generador_id,
+                    'fecha': fecha,
+                    'wait_ms': wait_ms,
+                    'attempts': attempts,
+                    'timed_out': timed_out,
+                    'user_id': self.env.uid,
+                })
+        except Exception as e:
+            _logger.warning("No se pudo registrar la espera de numeración: %s", str(e))
+
+    @api.autovacuum
+    def _gc_old_waits(self):
+        limit = fields.Datetime.now() - timedelta(days=self.WAIT_RETENTION_DAYS)
+        self.sudo().search([('create_date', '<', limit)]).unlink()
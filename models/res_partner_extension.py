@@ -1,5 +1,15 @@
 # -*- coding: utf-8 -*-
-from odoo import models, fields, api
+from odoo import models, fields, api, _
+from odoo.exceptions import ValidationError
+import re
+
+
+MANIFIESTO_INICIALES_PALABRAS_EXCLUIR = frozenset([
+    'S.A.', 'SA', 'S.A', 'DE', 'C.V.', 'CV', 'C.V', 'S.A.P.I.', 'SAPI',
+    'S. DE R.L.', 'S.R.L.', 'SRL', 'SOCIEDAD', 'ANONIMA', 'ANÓNIMA',
+    'CIVIL', 'RESPONSABILIDAD', 'LIMITADA', 'CAPITAL', 'VARIABLE',
+    'Y', 'E', 'LA', 'EL', 'LOS', 'LAS', 'DEL', 'CON', 'SIN', 'PARA', 'POR',
+])
 
 
 class ResPartner(models.Model):
@@ -41,40 +51,41 @@ class ResPartner(models.Model):
 
         También respeta service_order_child_only_display=True para mantener
         compatibilidad con el módulo service_order.
+
+        En ese modo el nombre estándar de los hijos no se calcula: solo se
+        llama a super() para los contactos que lo siguen necesitando.
         """
-        super()._compute_display_name()
+        if not self._is_child_only_display():
+            return super()._compute_display_name()
 
-        child_only = (
+        children = self.filtered(lambda partner: partner.parent_id and partner.name)
+        others = self - children
+        if others:
+            super(ResPartner, others)._compute_display_name()
+
+        for partner in children:
+            partner.display_name = partner.name
+
+    def _is_child_only_display(self):
+        return bool(
             self.env.context.get('manifiesto_child_only_display')
             or self.env.context.get('service_order_child_only_display')
         )
-        if not child_only:
-            return
-
-        for partner in self:
-            if partner.parent_id and partner.name:
-                partner.display_name = partner.name
 
     def name_get(self):
         """
         Compatibilidad con flujos Many2one que sigan usando name_get.
         En contexto normal conserva el comportamiento estándar.
         """
-        child_only = (
-            self.env.context.get('manifiesto_child_only_display')
-            or self.env.context.get('service_order_child_only_display')
-        )
-        if not child_only:
+        if not self._is_child_only_display():
             return super().name_get()
 
-        result = []
-        for partner in self:
-            if partner.parent_id and partner.name:
-                name = partner.name
-            else:
-                name = partner.name or partner.complete_name or ''
-            result.append((partner.id, name))
-        return result
+        # Una sola lectura para todo el recordset.
+        self.fetch(['name', 'parent_id', 'complete_name'])
+        return [
+            (partner.id, partner.name or partner.complete_name or '')
+            for partner in self
+        ]
 
     # =========================================================================
     # MÁSCARA PARA DOCUMENTOS OFICIALES / MANIFIESTO
@@ -87,6 +98,71 @@ class ResPartner(models.Model):
         ),
     )
 
+    manifiesto_iniciales = fields.Char(
+        string='Iniciales para Folio',
+        size=4,
+        compute='_compute_manifiesto_iniciales',
+        store=True,
+        readonly=False,
+        help=(
+            'Iniciales con las que empieza el folio automático del manifiesto '
+            '(ej. AB-27052026). Se calculan de la razón social al capturarla y '
+            'pueden corregirse a mano; no cambian si después cambia el nombre.'
+        ),
+    )
+
+    # =========================================================================
+    # RESPONSABLE DEL ACOPIO / DESTINATARIO
+    # =========================================================================
+    responsable_manifiesto_id = fields.Many2one(
+        'res.partner',
+        string='Responsable en Manifiesto',
+        compute='_compute_responsable_manifiesto_id',
+        store=True,
+        index='btree_not_null',
+        help=(
+            'Contacto que firma la sección Destinatario/Acopio del manifiesto: '
+            'el primer contacto hijo con etiqueta "Responsable" o, si no hay, '
+            'el propio contacto cuando tiene esa etiqueta.'
+        ),
+    )
+
+    def _has_manifiesto_responsable_tag(self):
+        """True si el contacto tiene una etiqueta (res.partner.category) que contenga 'responsable'."""
+        self.ensure_one()
+        return any(
+            'responsable' in (tag.name or '').strip().lower()
+            for tag in self.category_id
+        )
+
+    @api.depends(
+        'category_id',
+        'category_id.name',
+        'child_ids',
+        'child_ids.active',
+        'child_ids.category_id',
+        'child_ids.category_id.name',
+    )
+    def _compute_responsable_manifiesto_id(self):
+        """
+        Regla de negocio:
+        - Se busca primero entre los contactos hijos del acopio.
+        - El contacto debe tener una etiqueta que contenga 'Responsable'.
+        - Fallback controlado: el propio acopio, si tiene esa etiqueta.
+        - Los contactos archivados no cuentan.
+        - Si no existe responsable marcado, queda vacío.
+        """
+        for partner in self:
+            responsables = partner.child_ids.filtered(
+                lambda contact: contact.active and contact._has_manifiesto_responsable_tag()
+            )
+            if responsables:
+                partner.responsable_manifiesto_id = responsables.sorted('id')[:1]
+            elif partner._origin and partner._has_manifiesto_responsable_tag():
+                partner.responsable_manifiesto_id = partner._origin
+            else:
+                partner.responsable_manifiesto_id = False
+
     # =========================================================================
     # CAMPOS ADICIONALES DE DIRECCIÓN
     # =========================================================================
@@ -149,9 +225,62 @@ class ResPartner(models.Model):
         help='Marcar si este contacto es destinatario final de residuos peligrosos',
     )
 
+    # =========================================================================
+    # COMPUTES
+    # =========================================================================
+    @api.depends('name')
+    def _compute_manifiesto_iniciales(self):
+        for partner in self:
+            # Solo se llenan si están vacías: las iniciales ya usadas en
+            # folios no deben cambiar si se corrige la razón social.
+            if not partner.manifiesto_iniciales:
+                partner.manifiesto_iniciales = self._get_manifiesto_iniciales_from_name(partner.name)
+
+    # =========================================================================
+    # VALIDACIONES
+    # =========================================================================
+    @api.constrains('manifiesto_iniciales')
+    def _check_manifiesto_iniciales(self):
+        # El folio automático solo se reconoce con iniciales de 1 a 4 letras
+        # o dígitos; con otros caracteres los folios del generador dejarían de
+        # pasar por el contador diario.
+        for partner in self:
+            iniciales = (partner.manifiesto_iniciales or '').strip()
+            if iniciales and not re.fullmatch(r'\w{1,4}', iniciales):
+                raise ValidationError(_(
+                    "Las iniciales para folio de %(partner)s deben ser de 1 a 4 letras o números, "
+                    "sin espacios ni signos.",
+                    partner=partner.display_name,
+                ))
+
     # =========================================================================
     # HELPERS
     # =========================================================================
+    @api.model
+    def _get_manifiesto_iniciales_from_name(self, name):
+        """
+        Calcula las iniciales del folio a partir de la razón social.
+
+        Se toman las dos primeras palabras significativas (sin tipo de
+        sociedad ni artículos); con una sola palabra, sus dos primeras letras.
+        """
+        razon_social = (name or '').upper().strip()
+        if not razon_social:
+            return False
+
+        razon_limpia = re.sub(r'[^\w\s]', ' ', razon_social)
+        palabras_significativas = [
+            p for p in razon_limpia.split()
+            if p not in MANIFIESTO_INICIALES_PALABRAS_EXCLUIR and len(p) > 1
+        ]
+
+        if len(palabras_significativas) >= 2:
+            return palabras_significativas[0][0] + palabras_significativas[1][0]
+        if len(palabras_significativas) == 1:
+            return palabras_significativas[0][:2]
+
+        return re.sub(r'\W', '', razon_social)[:2] or False
+
     def _get_nombre_en_manifiesto(self):
         """
         Devuelve el nombre que debe usarse en el manifiesto.
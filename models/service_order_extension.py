@@ -1,6 +1,8 @@
 # models/service_order_extension.py
 # -*- coding: utf-8 -*-
 from odoo import models, fields, api, _
+from odoo.tools import float_compare
+from collections import defaultdict
 import logging
 
 _logger = logging.getLogger(__name__)
@@ -49,51 +51,18 @@ class ServiceOrder(models.Model):
 
 
     def _partner_has_responsable_tag(self, partner):
-        """
-        Detecta si un contacto tiene una etiqueta/categoría tipo Responsable.
-
-        Usa las etiquetas estándar de contactos de Odoo: res.partner.category
-        en partner.category_id.
-        """
-        if not partner:
-            return False
-
-        for tag in partner.category_id:
-            tag_name = (tag.name or '').strip().lower()
-            if 'responsable' in tag_name:
-                return True
-
-        return False
+        """Compatibilidad: ver res.partner._has_manifiesto_responsable_tag."""
+        return bool(partner) and partner._has_manifiesto_responsable_tag()
 
     def _get_acopio_responsable_contact(self, acopio_partner):
         """
         Devuelve el contacto responsable del Acopio/Destinatario.
 
-        Regla de negocio:
-        - Se busca primero entre los contactos hijos del Acopio/Destinatario.
-        - El contacto debe tener una etiqueta/categoría que contenga
-          'Responsable'.
-        - No se toma el contacto del generador.
-        - No se toma el contacto del cliente de la orden.
-        - Si no existe responsable marcado, se deja vacío.
+        La regla vive en el campo almacenado res.partner.responsable_manifiesto_id.
         """
-        Partner = self.env['res.partner']
-
         if not acopio_partner:
-            return Partner.browse()
-
-        responsables = acopio_partner.child_ids.filtered(
-            lambda contact: self._partner_has_responsable_tag(contact)
-        )
-
-        if responsables:
-            return responsables.sorted(lambda contact: contact.id)[:1]
-
-        # Fallback controlado: si el propio Acopio está marcado como Responsable.
-        if self._partner_has_responsable_tag(acopio_partner):
-            return acopio_partner
-
-        return Partner.browse()
+            return self.env['res.partner']
+        return acopio_partner.responsable_manifiesto_id
 
     def _get_acopio_responsable_nombre(self, acopio_partner):
         responsable = self._get_acopio_responsable_contact(acopio_partner)
@@ -167,16 +136,30 @@ class ServiceOrder(models.Model):
                 'envase_capacidad': capacidad_final,
                 'etiqueta_si': True,
                 'etiqueta_no': False,
+                'origin_line_id': line.id,
             }))
 
         return residuo_lines
 
-    def _prepare_manifiesto_vals_from_order(self):
+    def _get_manifiesto_partners(self):
+        """Contactos de las órdenes que se copian al manifiesto (generador, transportista, destinatario)."""
+        return (
+            self.generador_id | self.partner_id | self.transportista_id | self.destinatario_id
+        )
+
+    def _prepare_manifiesto_vals_from_order(self, partner_snapshots=None):
+        """
+        Valores del manifiesto de la orden. `partner_snapshots` permite reusar
+        la lectura de contactos de un lote de órdenes (ver
+        manifiesto.ambiental._read_partner_snapshots).
+        """
         self.ensure_one()
+        Manifiesto = self.env['manifiesto.ambiental']
+        if partner_snapshots is None:
+            partner_snapshots = Manifiesto._read_partner_snapshots(self._get_manifiesto_partners().ids)
 
         # 1. Generador
         generador = self.generador_id if self.generador_id else self.partner_id
-        nombre_razon_social = self._get_partner_nombre_en_manifiesto(generador)
 
         # 2. Fecha del servicio
         fecha_servicio = self._get_manifiesto_fecha_servicio()
@@ -200,12 +183,9 @@ class ServiceOrder(models.Model):
         vehicle_id = vehicle.id if vehicle else False
         numero_placa = self.numero_placa or (vehicle.license_plate if vehicle else '') or ''
 
-        # 7. Tipo de vehículo
-        tipo_vehiculo = ''
-        if vehicle:
-            brand = vehicle.model_id.brand_id.name if vehicle.model_id and vehicle.model_id.brand_id else ''
-            model = vehicle.model_id.name if vehicle.model_id else ''
-            tipo_vehiculo = f"{brand} {model}".strip() or vehicle.name or ''
+        # 7. Tipo de vehículo (misma regla que el manifiesto, ver
+        # fleet.vehicle.tipo_vehiculo_manifiesto)
+        tipo_vehiculo = (vehicle.tipo_vehiculo_manifiesto if vehicle else '') or ''
 
         if not tipo_vehiculo and self.transportista_id:
             tipo_vehiculo = self.transportista_id.tipo_vehiculo or ''
@@ -243,40 +223,17 @@ class ServiceOrder(models.Model):
                 instrucciones_manifiesto = getattr(self, field_name) or ''
                 break
 
-        return {
+        vals = {
             'service_order_id': self.id,
 
             # --- GENERADOR ---
             'generador_id': generador.id if generador else False,
-            'numero_registro_ambiental': generador.numero_registro_ambiental if generador else '',
-            'generador_nombre': nombre_razon_social,
-            'generador_codigo_postal': generador.zip if generador else '',
-            'generador_calle': generador.street if generador else '',
-            'generador_num_ext': generador.street_number if generador else '',
-            'generador_num_int': generador.street_number2 if generador else '',
-            'generador_colonia': generador.street2 if generador else '',
-            'generador_municipio': generador.city if generador else '',
-            'generador_estado': generador.state_id.name if generador and generador.state_id else '',
-            'generador_telefono': generador.phone if generador else '',
-            'generador_email': generador.email if generador else '',
             'generador_responsable_id': self.generador_responsable_id.id if self.generador_responsable_id else False,
             'generador_responsable_nombre': self.generador_responsable_id.name if self.generador_responsable_id else '',
             'generador_fecha': fecha_servicio,
 
             # --- TRANSPORTISTA ---
             'transportista_id': self.transportista_id.id if self.transportista_id else False,
-            'transportista_nombre': self._get_partner_nombre_en_manifiesto(self.transportista_id),
-            'transportista_codigo_postal': self.transportista_id.zip if self.transportista_id else '',
-            'transportista_calle': self.transportista_id.street if self.transportista_id else '',
-            'transportista_num_ext': self.transportista_id.street_number if self.transportista_id else '',
-            'transportista_num_int': self.transportista_id.street_number2 if self.transportista_id else '',
-            'transportista_colonia': self.transportista_id.street2 if self.transportista_id else '',
-            'transportista_municipio': self.transportista_id.city if self.transportista_id else '',
-            'transportista_estado': self.transportista_id.state_id.name if (self.transportista_id and self.transportista_id.state_id) else '',
-            'transportista_telefono': self.transportista_id.phone if self.transportista_id else '',
-            'transportista_email': self.transportista_id.email if self.transportista_id else '',
-            'numero_autorizacion_semarnat': self.transportista_id.numero_autorizacion_semarnat if self.transportista_id else '',
-            'numero_permiso_sct': self.transportista_id.numero_permiso_sct if self.transportista_id else '',
 
             # --- VEHÍCULO, PLACA, CHOFER ---
             'vehicle_id': vehicle_id,
@@ -291,17 +248,6 @@ class ServiceOrder(models.Model):
 
             # --- DESTINATARIO ---
             'destinatario_id': dest.id if dest else False,
-            'destinatario_nombre': self._get_partner_nombre_en_manifiesto(dest),
-            'destinatario_codigo_postal': dest.zip if dest else '',
-            'destinatario_calle': dest.street if dest else '',
-            'destinatario_num_ext': dest.street_number if dest else '',
-            'destinatario_num_int': dest.street_number2 if dest else '',
-            'destinatario_colonia': dest.street2 if dest else '',
-            'destinatario_municipio': dest.city if dest else '',
-            'destinatario_estado': dest.state_id.name if dest and dest.state_id else '',
-            'destinatario_telefono': dest.phone if dest else '',
-            'destinatario_email': dest.email if dest else '',
-            'numero_autorizacion_semarnat_destinatario': dest.numero_autorizacion_semarnat if dest else '',
             'destinatario_fecha': fecha_servicio,
             'destinatario_responsable_nombre': destinatario_responsable_nombre,
 
@@ -314,13 +260,30 @@ class ServiceOrder(models.Model):
             'residuo_ids': residuo_lines,
         }
 
+        # Datos de contacto por rol, según MANIFIESTO_PARTNER_FIELD_MAP.
+        for role, partner in (
+            ('generador_id', generador),
+            ('transportista_id', self.transportista_id),
+            ('destinatario_id', dest),
+        ):
+            vals.update(Manifiesto._get_partner_role_vals(role, partner_snapshots.get(partner.id)))
+
+        return vals
+
     def _find_open_manifiesto(self):
         self.ensure_one()
-        return self.env['manifiesto.ambiental'].search([
-            ('service_order_id', '=', self.id),
+        return self._find_open_manifiestos().get(self.id, self.env['manifiesto.ambiental'])
+
+    def _find_open_manifiestos(self):
+        """{order_id: manifiesto abierto más reciente} con una sola búsqueda."""
+        open_by_order = {}
+        for manifiesto in self.env['manifiesto.ambiental'].search([
+            ('service_order_id', 'in', self.ids),
             ('state', 'in', list(self.MANIFIESTO_OPEN_STATES)),
             ('is_current_version', '=', True),
-        ], order='id desc', limit=1)
+        ], order='id desc'):
+            open_by_order.setdefault(manifiesto.service_order_id.id, manifiesto)
+        return open_by_order
 
     def _sync_existing_manifiesto_from_order(self, manifiesto, manifiesto_vals):
         """
@@ -349,11 +312,61 @@ class ServiceOrder(models.Model):
             update_vals.pop(protected_field, None)
 
         if manifiesto.state in ('draft', 'confirmed') and not manifiesto.recepcion_ids:
-            update_vals['residuo_ids'] = [(5, 0, 0)] + residuo_lines
+            residuo_commands = self._get_manifiesto_residuo_sync_commands(manifiesto, residuo_lines)
+            if residuo_commands:
+                update_vals['residuo_ids'] = residuo_commands
 
-        manifiesto.write(update_vals)
+        # El chatter del manifiesto resume las líneas agregadas/eliminadas
+        # como resincronización en lugar de un mensaje por línea.
+        manifiesto.with_context(manifiesto_residuo_resync=True).write(update_vals)
         return manifiesto
 
+    @api.model
+    def _residuo_value_changed(self, residuo, field_name, value):
+        field = residuo._fields[field_name]
+        current = residuo[field_name]
+        if field.type == 'many2one':
+            return current.id != (value or False)
+        if field.type == 'float':
+            return float_compare(current, value or 0.0, precision_digits=6) != 0
+        if field.type in ('char', 'text', 'selection'):
+            return (current or False) != (value or False)
+        return current != value
+
+    def _get_manifiesto_residuo_sync_commands(self, manifiesto, residuo_lines):
+        """
+        Comandos mínimos para llevar las líneas del manifiesto a las de la orden.
+
+        Las líneas se emparejan por (producto, línea de origen). Solo se
+        actualizan los campos que cambiaron, se crean las líneas nuevas y se
+        eliminan las que ya no existen en la orden; las líneas sin cambios
+        conservan su lote y no generan mensajes.
+        """
+        existing = defaultdict(list)
+        for residuo in manifiesto.residuo_ids:
+            existing[(residuo.product_id.id, residuo.origin_line_id)].append(residuo)
+
+        commands = []
+        for _command, _id, vals in residuo_lines:
+            key = (vals.get('product_id') or False, vals.get('origin_line_id') or 0)
+            if not existing.get(key):
+                commands.append((0, 0, vals))
+                continue
+
+            residuo = existing[key].pop(0)
+            changes = {
+                field_name: value
+                for field_name, value in vals.items()
+                if self._residuo_value_changed(residuo, field_name, value)
+            }
+            if changes:
+                commands.append((1, residuo.id, changes))
+
+        for residuos in existing.values():
+            commands.extend((2, residuo.id, 0) for residuo in residuos)
+
+        return commands
+
     def _get_manifiesto_action(self, manifiesto):
         return {
             'name': 'Manifiesto Ambiental',
@@ -364,18 +377,56 @@ class ServiceOrder(models.Model):
             'target': 'current',
         }
 
-    def action_create_manifiesto(self):
-        self.ensure_one()
+    def _create_or_sync_manifiestos(self):
+        """
+        Genera el manifiesto de cada orden: sincroniza el abierto si existe y
+        crea los faltantes en un solo create().
 
-        manifiesto_vals = self._prepare_manifiesto_vals_from_order()
+        Los contactos, vehículos y líneas de todas las órdenes se cargan en
+        bloque antes de preparar los valores.
+        """
+        Manifiesto = self.env['manifiesto.ambiental']
+        if not self:
+            return Manifiesto
+
+        self.fetch([
+            'partner_id', 'generador_id', 'destinatario_id', 'transportista_id',
+            'generador_responsable_id', 'transportista_responsable_id',
+            'vehicle_id', 'chofer_id', 'line_ids',
+        ])
+        self.destinatario_id.responsable_manifiesto_id.mapped('name')
+        self.vehicle_id.fetch(['license_plate', 'tipo_vehiculo_manifiesto'])
+        self.line_ids.product_id.fetch(['name'])
+
+        open_by_order = self._find_open_manifiestos()
+        partner_snapshots = Manifiesto._read_partner_snapshots(self._get_manifiesto_partners().ids)
+
+        manifiestos = Manifiesto
+        vals_to_create = []
+        for order in self:
+            manifiesto_vals = order._prepare_manifiesto_vals_from_order(partner_snapshots=partner_snapshots)
+            manifiesto = open_by_order.get(order.id)
+            if manifiesto:
+                manifiestos |= order._sync_existing_manifiesto_from_order(manifiesto, manifiesto_vals)
+            else:
+                vals_to_create.append(manifiesto_vals)
+
+        if vals_to_create:
+            manifiestos |= Manifiesto.create(vals_to_create)
+
+        return manifiestos
 
-        manifiesto = self._find_open_manifiesto()
-        if manifiesto:
-            manifiesto = self._sync_existing_manifiesto_from_order(
-                manifiesto,
-                manifiesto_vals,
-            )
-        else:
-            manifiesto = self.env['manifiesto.ambiental'].create(manifiesto_vals)
+    def action_create_manifiesto(self):
+        manifiestos = self._create_or_sync_manifiestos()
 
-        return self._get_manifiesto_action(manifiesto)
+        if len(manifiestos) == 1:
+            return self._get_manifiesto_action(manifiestos)
+
+        return {
+            'name': _('Manifiestos Ambientales'),
+            'type': 'ir.actions.act_window',
+            'res_model': 'manifiesto.ambiental',
+            'view_mode': 'list,form',
+            'domain': [('id', 'in', manifiestos.ids)],
+            'target': 'current',
+        }
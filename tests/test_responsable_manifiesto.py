@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from odoo.tests import TransactionCase, tagged
+
+
+@tagged('post_install', '-at_install')
+class TestResponsableManifiesto(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tag_responsable = cls.env['res.partner.category'].create({'name': 'Responsable'})
+        cls.acopio = cls.env['res.partner'].create({
+            'name': 'ACOPIO PRUEBA',
+            'is_company': True,
+            'es_destinatario': True,
+        })
+        cls.responsable = cls.env['res.partner'].create({
+            'name': 'RESPONSABLE PRUEBA',
+            'parent_id': cls.acopio.id,
+            'category_id': [(6, 0, cls.tag_responsable.ids)],
+        })
+
+    def test_responsable_child(self):
+        self.assertEqual(self.acopio.responsable_manifiesto_id, self.responsable)
+
+    def test_archived_responsable_child(self):
+        """Archivar al responsable lo quita del acopio y pasa al siguiente."""
+        suplente = self.env['res.partner'].create({
+            'name': 'SUPLENTE PRUEBA',
+            'parent_id': self.acopio.id,
+            'category_id': [(6, 0, self.tag_responsable.ids)],
+        })
+
+        self.responsable.action_archive()
+        self.assertEqual(self.acopio.responsable_manifiesto_id, suplente)
+
+        suplente.action_archive()
+        self.assertFalse(self.acopio.responsable_manifiesto_id)
+
+        self.responsable.action_unarchive()
+        self.assertEqual(self.acopio.responsable_manifiesto_id, self.responsable)